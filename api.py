@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+from typing import Literal, Optional
+
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from filter import Filter
+from metrics import get_sink, increment
+from result_cache import ResultCache
+from query_keys import make_query_id
+from search import search_async
+
+# Limits for the JSON API
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "8"))   # Searches computed at once
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "30"))                # Seconds a request waits for its results
+API_MAX_PER_PAGE = 50
+
+app = FastAPI(title="Deathstroke Search API")
+
+# Filtered results, shared by every request for the same query and country
+result_cache = ResultCache()
+
+# (query, country) -> task computing its results
+_inflight = {}
+
+
+class Saturated(Exception):
+    pass
+
+
+async def compute_results(query, country, mode="web"):
+    """
+    Run the search pipeline and the content and tracker filters.
+
+    Args:
+        query (str): Search query
+        country (str): Two-letter country code or None
+        mode (str): web or local, see search.search
+
+    Returns:
+        DataFrame: Filtered results without HTML
+    """
+    results = await search_async(query, country=country, mode=mode)
+    # Filtering parses HTML, which is CPU bound; keep it off the event loop
+    filtered = await asyncio.to_thread(lambda: Filter(results).filter())
+    return filtered.drop(columns=["html"], errors="ignore")
+
+
+def _finish(key, task):
+    _inflight.pop(key, None)
+    if not task.cancelled() and task.exception() is None:
+        result_cache.put(key, task.result())
+
+
+async def get_results(query, country, mode="web"):
+    """
+    Return the filtered results for a query, computing them at most once at a time.
+
+    Requests for a query that is already being computed wait for that
+    computation. A timed out request doesn't cancel it, so the results
+    still land in the cache for the next request.
+
+    Args:
+        query (str): Search query
+        country (str): Two-letter country code or None
+        mode (str): web or local, see search.search
+
+    Returns:
+        DataFrame: Filtered results
+
+    Raises:
+        Saturated: If API_MAX_CONCURRENCY searches are already running
+        asyncio.TimeoutError: If the results took longer than API_TIMEOUT
+    """
+    # Queries that differ only in case, word order or stopwords share an entry
+    key = (make_query_id(query, country), mode)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    task = _inflight.get(key)
+    if task is None:
+        if len(_inflight) >= API_MAX_CONCURRENCY:
+            raise Saturated()
+        task = asyncio.create_task(compute_results(query, country, mode))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _finish(key, t))
+    return await asyncio.wait_for(asyncio.shield(task), API_TIMEOUT)
+
+
+@app.get("/search")
+async def search_endpoint(
+    q: str = Query(..., min_length=1, description="Search query"),
+    country: Optional[str] = Query(None, min_length=2, max_length=2, description="Two-letter country code"),
+    page: int = Query(1, ge=1),
+    per_page: int = Query(10, ge=1, le=API_MAX_PER_PAGE),
+    mode: Literal["web", "local"] = Query("web", description="local answers from stored results only"),
+):
+    """Search and return one page of results as JSON."""
+    country = country.upper() if country else None
+    try:
+        results = await get_results(q, country, mode)
+    except Saturated:
+        increment("api_rejected")
+        raise HTTPException(status_code=429, detail="Too many searches in progress, try again shortly",
+                            headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        increment("api_timeouts")
+        raise HTTPException(status_code=504, detail="Search timed out")
+
+    start = (page - 1) * per_page
+    page_results = results.iloc[start:start + per_page]
+    return {
+        "query": q,
+        "country": country,
+        "mode": mode,
+        "page": page,
+        "per_page": per_page,
+        "total": len(results),
+        # to_json turns NaN into null and timestamps into ISO strings
+        "results": json.loads(page_results.to_json(orient="records", date_format="iso")),
+    }
+
+
+@app.get("/health")
+async def health():
+    """Report searches in progress and result cache usage."""
+    return {"status": "ok", "inflight": len(_inflight), "cache": result_cache.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Expose pipeline metrics in the Prometheus text format."""
+    sink = get_sink()
+    if not hasattr(sink, "render"):
+        raise HTTPException(status_code=404, detail="Set METRICS_SINK=prometheus to expose metrics")
+    return sink.render()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", "8000")))
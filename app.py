@@ -1,11 +1,20 @@
 import streamlit as st
-from search import search
-from filter import Filter
-from storage import DBStorage
-import pandas as pd
-import time
+import math
+import os
 import json
+import queue
 import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# Geolocation: an optional offline MaxMind GeoLite2/GeoIP2 Country database
+# replaces the ipinfo.io lookup
+GEOIP_DB = os.getenv("GEOIP_DB")
+GEOIP_TIMEOUT = 2           # Seconds for the ipinfo.io request
+GEOIP_TTL = 24 * 3600       # Seconds a client IP's country is remembered
+
+# Fragments rerun only the decorated function when one of its widgets is used;
+# older Streamlit versions only have the experimental name
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
 
 # Page configuration
 st.set_page_config(
@@ -202,16 +211,72 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-def get_user_country():
-    """Attempt to get user's country from IP address using ipinfo.io"""
+def get_client_ip():
+    """Return the client's IP address if Streamlit exposes it, otherwise None."""
+    context = getattr(st, "context", None)
+    if context is None:
+        return None
     try:
-        response = requests.get('https://ipinfo.io/json')
-        data = response.json()
-        return data.get('country', None)  # Returns two-letter country code like 'US'
-    except:
+        forwarded = context.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+        return getattr(context, "ip_address", None)
+    except Exception:
         return None
 
 
+@st.cache_resource
+def get_geoip_reader():
+    """Open the offline GeoIP database once per process."""
+    import geoip2.database
+    return geoip2.database.Reader(GEOIP_DB)
+
+
+@st.cache_data(ttl=GEOIP_TTL, show_spinner=False)
+def lookup_country(ip):
+    """
+    Look up the country for an IP address, cached per IP for GEOIP_TTL.
+
+    Uses the GEOIP_DB file when configured, and never goes to the network in
+    that case; otherwise asks ipinfo.io with a short timeout. Failed lookups
+    raise instead of returning None, so they aren't cached.
+
+    Args:
+        ip (str): Client IP address, or None for the server's own address
+
+    Returns:
+        str: Two-letter country code like 'US', or None if the IP has no known country
+
+    Raises:
+        Exception: If the lookup failed, e.g. ipinfo.io timed out or rate limited us
+    """
+    if GEOIP_DB:
+        if not ip:
+            return None
+        import geoip2.errors
+        try:
+            return get_geoip_reader().country(ip).country.iso_code
+        except geoip2.errors.AddressNotFoundError:
+            return None
+
+    url = f'https://ipinfo.io/{ip}/json' if ip else 'https://ipinfo.io/json'
+    response = requests.get(url, timeout=GEOIP_TIMEOUT)
+    response.raise_for_status()
+    return response.json().get('country', None)  # Returns two-letter country code like 'US'
+
+
+def get_user_country():
+    """Attempt to get user's country from their IP address, once per session"""
+    if 'user_country' not in st.session_state:
+        try:
+            st.session_state.user_country = lookup_country(get_client_ip())
+        except Exception as e:
+            # Not cached by lookup_country, so the next session tries again
+            print(f"Error looking up country: {e}")
+            st.session_state.user_country = None
+    return st.session_state.user_country
+
+
 # Country name mapping (for display purposes)
 def get_country_list():
     return {
@@ -310,9 +375,10 @@ def show_search_form():
     return None, None
 
 
-def display_result(index, row):
+def display_result(index, row, interactive=True):
     # Check if this result has been semantically ranked (if that field exists)
-    has_semantic_ranking = 'semantic_score' in row
+    semantic_score = row.get('semantic_score')
+    has_semantic_ranking = semantic_score is not None and not math.isnan(semantic_score)
     # Check if country filter was applied
     has_country_filter = 'country' in st.session_state and st.session_state.country is not None
 
@@ -337,22 +403,40 @@ def display_result(index, row):
         """, unsafe_allow_html=True)
 
         # We still need the actual button for functionality
-        if st.button("Mark Relevant", key=f"rel_{index}", help="Mark this result as relevant for your search"):
-            mark_relevant(st.session_state.query, row['link'])
+        if interactive:
+            st.button("Mark Relevant", key=f"rel_{index}",
+                      help="Mark this result as relevant for your search",
+                      on_click=mark_relevant, args=(row['query'], row['link']))
 
 
 def mark_relevant(query, link):
-    storage = DBStorage()
-    storage.update_relevance(query, link, 10)
-    st.success(f"✅ Marked as relevant")
-    time.sleep(1)
-    st.rerun()
+    """Queue a relevance write; the database is only touched by the background writer."""
+    from storage import get_storage, get_writer
+
+    def write():
+        get_storage().update_relevance(query, link, 10)
+
+    get_writer().submit(write)
+    st.toast("✅ Marked as relevant")
+
+
+def change_search_mode():
+    # Results from the other mode no longer apply
+    st.session_state.pop('all_results_df', None)
+    st.session_state.page = 1
 
 
 def show_sidebar_info():
     with st.sidebar:
         st.title("Search Options")
 
+        st.checkbox(
+            "Offline search",
+            key="offline_mode",
+            on_change=change_search_mode,
+            help="Answer from previously stored results only, without calling Google or Gemini",
+        )
+
         st.subheader("About this search engine")
         st.info("""
         This advanced search application uses Google's Gemini AI to enhance search results:
@@ -425,16 +509,81 @@ def show_sidebar_info():
                 st.rerun()
 
 
-def run_search(query, country=None):
-    with st.spinner("Searching with AI-enhanced results..."):
-        # The search function now integrates Gemini for better results
-        results = search(query, country=country)
+def display_preview(results, results_per_page=10):
+    """
+    Show the first page of partial results while the search is still running.
+
+    Buttons are left out: the preview is redrawn for every pipeline stage,
+    and widgets can only be created once per run.
+    """
+    st.markdown(f"### Found {len(results)} results for \"{st.session_state.query}\" (refining...)")
+    for index, row in results.head(results_per_page).iterrows():
+        display_result(index, row, interactive=False)
+
+
+@st.cache_resource
+def get_result_cache():
+    """Result cache shared by every session in this process."""
+    from result_cache import ResultCache
+    return ResultCache()
+
+
+def run_search(query, country=None, mode="web"):
+    # Imported here so the search form renders before the search stack loads
+    from search import search_stream
+    from filter import Filter
+    from query_keys import make_query_id
+
+    # Partial results are drawn here, in place, as each pipeline stage finishes
+    preview = st.empty()
+    stages = queue.Queue()
+
+    def compute():
+        # The search pipeline integrates Gemini for better results
+        results = None
+        for results in search_stream(query, country=country, mode=mode):
+            stages.put(results)
 
         # We still apply our traditional filtering as well
         fi = Filter(results)
         filtered = fi.filter()
 
-        return filtered
+        # The page HTML isn't displayed, so don't spend the cache's memory on it
+        return filtered.drop(columns=["html"], errors="ignore")
+
+    with st.spinner("Searching with AI-enhanced results..."):
+        # Sessions running the same search share one computation and its result.
+        # Queries that differ only in case, word order or stopwords share an entry.
+        # It runs in a worker thread and only this session draws, so a rerun or stop
+        # of this session never reaches the computation other sessions wait on.
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(get_result_cache().get_or_compute, (make_query_id(query, country), mode),
+                                     compute)
+            while True:
+                try:
+                    results = stages.get(timeout=0.1)
+                except queue.Empty:
+                    if future.done():
+                        break
+                    continue
+                with preview.container():
+                    display_preview(results)
+            filtered = future.result()
+        finally:
+            # If this session is interrupted, the search still finishes and fills the cache
+            executor.shutdown(wait=False)
+
+    preview.empty()
+    return filtered
+
+
+def set_page(page):
+    st.session_state.page = page
+
+
+def select_page():
+    set_page(int(st.session_state.page_select.split(" ")[1]))
 
 
 def display_pagination(total_results, results_per_page):
@@ -461,14 +610,10 @@ def display_pagination(total_results, results_per_page):
     col1, col2, col3, col4 = st.columns([1, 1, 2, 1])
 
     with col1:
-        if st.button("◀ Previous", disabled=prev_disabled):
-            st.session_state.page = max(1, current_page - 1)
-            st.rerun()
+        st.button("◀ Previous", disabled=prev_disabled, on_click=set_page, args=(max(1, current_page - 1),))
 
     with col2:
-        if st.button("Next ▶", disabled=next_disabled):
-            st.session_state.page = min(total_pages, current_page + 1)
-            st.rerun()
+        st.button("Next ▶", disabled=next_disabled, on_click=set_page, args=(min(total_pages, current_page + 1),))
 
     with col3:
         page_info = f"Page {current_page} of {total_pages} | " \
@@ -480,15 +625,17 @@ def display_pagination(total_results, results_per_page):
         # Add a direct page selection dropdown for quick navigation
         if total_pages > 1:
             page_options = [f"Page {i}" for i in range(1, total_pages + 1)]
-            selected_page = st.selectbox(
+            # Let the selector follow page changes made elsewhere
+            if st.session_state.get("page_select") != f"Page {current_page}":
+                st.session_state.pop("page_select", None)
+            st.selectbox(
                 "",
                 options=page_options,
                 index=current_page - 1,
+                key="page_select",
+                on_change=select_page,
                 label_visibility="collapsed"
             )
-            if f"Page {current_page}" != selected_page:
-                st.session_state.page = int(selected_page.split(" ")[1])
-                st.rerun()
 
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -509,16 +656,15 @@ show_search_header()
 query_result, country = show_search_form()
 show_sidebar_info()
 
-# Display search results
-if st.session_state.search_performed:
-    # Get all results only if we don't already have them stored
-    if 'all_results_df' not in st.session_state:
-        all_results_df = run_search(st.session_state.query, country=st.session_state.country)
-        # Store the entire results dataframe in session state
-        st.session_state.all_results_df = all_results_df
-    else:
-        # Use the stored results
-        all_results_df = st.session_state.all_results_df
+@fragment
+def show_results():
+    """
+    Draw the current page of results and the pagination controls.
+
+    Runs as a fragment: pagination and relevance clicks rerun only this
+    function instead of the whole script.
+    """
+    all_results_df = st.session_state.all_results_df
 
     # Define results per page
     results_per_page = 10
@@ -541,4 +687,16 @@ if st.session_state.search_performed:
 
     # Display pagination controls
     if total_results > results_per_page:
-        display_pagination(total_results, results_per_page)
\ No newline at end of file
+        display_pagination(total_results, results_per_page)
+
+
+# Display search results
+if st.session_state.search_performed:
+    # Get all results only if we don't already have them stored
+    if 'all_results_df' not in st.session_state:
+        # Store the entire results dataframe in session state
+        mode = "local" if st.session_state.get('offline_mode') else "web"
+        st.session_state.all_results_df = run_search(st.session_state.query, country=st.session_state.country,
+                                                     mode=mode)
+
+    show_results()
\ No newline at end of file
@@ -0,0 +1,360 @@
+"""
+Offline benchmark for the search pipeline.
+
+    python benchmark.py --queries 20 --llm-latency 0.05 --save baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.25 --max-p95 warm:search=0.05
+
+Every backend is local: the Custom Search API and result pages come from
+fakes.FakeSearchServer (generated pages, or recorded ones with --corpus),
+Gemini from fakes.FakeGenerativeModel, and the database lives in a
+temporary directory.
+
+Each stage runs once per query on a cold cache (unseen queries, empty
+database and LLM response cache), then again on a warm cache (the same
+queries). The report gives p50/p95/p99 latency, throughput and peak traced
+memory per stage, plus the import time of the main modules. The run exits
+with status 1 if a stage is slower than a --max-p95 limit (imports have
+default limits, see IMPORT_LIMITS), regressed against a --baseline report,
+or if importing search or filter loads a module that must stay lazy.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+# Modules whose import time is measured, each in a fresh interpreter
+IMPORT_MODULES = ["search", "filter", "gemini_integration", "storage", "page_parser"]
+
+# Default p95 import-time limits in seconds; a --max-p95 for the same stage overrides them
+IMPORT_LIMITS = {
+    "import search": 1.0,
+    "import filter": 1.0,
+    "import gemini_integration": 1.0,
+    "import storage": 1.0,
+    "import page_parser": 0.5,
+}
+
+# Modules that importing each module must not load yet; they are loaded on first use
+LAZY_MODULES = {
+    "search": ["google.generativeai", "gemini_integration", "page_parser", "bs4"],
+    "filter": ["google.generativeai", "gemini_integration"],
+}
+
+# Differences below this many seconds are noise, not regressions
+NOISE_FLOOR = 0.005
+
+PASSES = ["cold", "warm"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=10, help="Queries per pass")
+    parser.add_argument("--results", type=int, default=30, help="Results the fake API returns per query")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Fake search API latency in seconds")
+    parser.add_argument("--page-latency", type=float, default=0.0, help="Fake page latency in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Fake Gemini latency in seconds")
+    parser.add_argument("--corpus", help="Directory of recorded .html pages to serve instead of generated ones")
+    parser.add_argument("--import-runs", type=int, default=3, help="Fresh interpreters per import measurement")
+    parser.add_argument("--save", help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", help="Fail if a stage's p95 regressed against this saved report")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 slowdown against the baseline")
+    parser.add_argument("--max-p95", action="append", default=[], metavar="[PASS:]STAGE=SECONDS",
+                        help="Fail if a stage's p95 exceeds this; applies to both passes unless PASS is given")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    return parser.parse_args()
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def summarize(samples):
+    """
+    Summarize the durations of one stage.
+
+    Args:
+        samples (list): Durations in seconds
+
+    Returns:
+        dict: Run count, p50/p95/p99 and mean in seconds, and runs per second
+    """
+    values = sorted(samples)
+    total = sum(values)
+    return {
+        "runs": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": total / len(values) if values else 0.0,
+        "throughput": len(values) / total if total else 0.0,
+    }
+
+
+def measure_imports(modules, runs):
+    """
+    Time importing each module in a fresh interpreter.
+
+    Args:
+        modules (list): Module names
+        runs (int): Interpreters started per module
+
+    Returns:
+        dict: "import <module>" -> list of durations in seconds
+    """
+    code = ("import sys, time\n"
+            "started = time.perf_counter()\n"
+            "__import__(sys.argv[1])\n"
+            "print(time.perf_counter() - started)")
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = {}
+    for module in modules:
+        durations = []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", code, module], capture_output=True, text=True,
+                                 cwd=here, check=True)
+            # Modules may print warnings of their own; the timing is the last line
+            durations.append(float(out.stdout.strip().splitlines()[-1]))
+        samples[f"import {module}"] = durations
+    return samples
+
+
+def check_lazy_imports(lazy=LAZY_MODULES):
+    """
+    Import each module in a fresh interpreter and report the lazily loaded modules that came with it.
+
+    Args:
+        lazy (dict): Module -> modules importing it must not load
+
+    Returns:
+        list: Descriptions of the modules that were loaded eagerly
+    """
+    code = ("import json, sys\n"
+            "__import__(sys.argv[1])\n"
+            "print(json.dumps([name for name in sys.argv[2:] if name in sys.modules]))")
+    here = os.path.dirname(os.path.abspath(__file__))
+    failures = []
+    for module, names in lazy.items():
+        out = subprocess.run([sys.executable, "-c", code, module, *names], capture_output=True, text=True,
+                             cwd=here, check=True)
+        for name in json.loads(out.stdout.strip().splitlines()[-1]):
+            failures.append(f"import {module}: loads {name}, which must stay lazy")
+    return failures
+
+
+class Pipeline():
+    def __init__(self, trace_memory=False):
+        """
+        Runs the search pipeline stage by stage, timing each one.
+
+        Args:
+            trace_memory (bool): Record the peak traced memory of each stage instead of
+                timing it; tracemalloc must be started
+        """
+        self.trace_memory = trace_memory
+        self.samples = defaultdict(list)
+        self.peaks = defaultdict(int)
+
+    def stage(self, name, func, *args):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = func(*args)
+            self.peaks[name] = max(self.peaks[name], tracemalloc.get_traced_memory()[1] - before)
+            return result
+
+        started = time.perf_counter()
+        result = func(*args)
+        self.samples[name].append(time.perf_counter() - started)
+        return result
+
+    def run(self, query):
+        """Run every stage for one query."""
+        import search
+        from filter import Filter
+
+        gemini = search.get_gemini()
+        expanded = self.stage("expand_query", gemini.expand_query, query)
+        results = self.stage("search_api", search.api_results, query, expanded, query)
+        results = self.stage("scrape_page", search.scrape_results, results)
+        self.stage("rank_embedding", gemini.rank_results_by_embedding, query, results)
+        results = self.stage("rank_semantically", gemini.rank_results_semantically, query, results)
+        results = self.stage("filter_content", gemini.filter_content, results)
+        results = self.stage("snippets", gemini.generate_improved_snippets, results)
+        self.stage("store", search.store_results, results)
+        self.stage("load", search.load_stored_results, query)
+        self.stage("Filter.filter", lambda: Filter(results).filter())
+        # End to end, on its own query so the stages above don't warm it up
+        self.stage("search", search.search, f"{query} end to end")
+
+
+def run_passes(queries, model, quiet):
+    """
+    Time the pipeline on a cold and then a warm cache, and trace its memory.
+
+    Args:
+        queries (list): Queries to run in each pass
+        model (FakeGenerativeModel): Model the enhancers call, for counting LLM calls
+        quiet (bool): Hide the pipeline's own output
+
+    Returns:
+        dict: Pass name -> stage name -> summary
+    """
+    import search
+
+    cache = search.get_gemini().cache
+    output = contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext()
+    report = {}
+    with output:
+        for name in PASSES:
+            pipeline = Pipeline()
+            calls, hits, misses = model.calls, cache.hits, cache.misses
+            started = time.perf_counter()
+            for query in queries:
+                pipeline.run(query)
+            elapsed = time.perf_counter() - started
+            report[name] = {stage: summarize(samples) for stage, samples in pipeline.samples.items()}
+            report[name]["pass"] = {
+                "queries": len(queries),
+                "seconds": elapsed,
+                "queries_per_second": len(queries) / elapsed if elapsed else 0.0,
+                "llm_calls": model.calls - calls,
+                "llm_cache_hits": cache.hits - hits,
+                "llm_cache_misses": cache.misses - misses,
+            }
+
+        # Memory is traced on separate runs; tracemalloc slows everything down
+        tracemalloc.start()
+        try:
+            for name in PASSES:
+                pipeline = Pipeline(trace_memory=True)
+                pipeline.run("benchmark memory probe")
+                for stage, peak in pipeline.peaks.items():
+                    report[name][stage]["peak_bytes"] = peak
+        finally:
+            tracemalloc.stop()
+    return report
+
+
+def print_report(report):
+    for name in PASSES:
+        info = report[name]["pass"]
+        print(f"\n{name} cache: {info['queries']} queries in {info['seconds']:.2f}s "
+              f"({info['queries_per_second']:.1f} queries/s), {info['llm_calls']} LLM calls, "
+              f"{info['llm_cache_hits']} LLM cache hits, {info['llm_cache_misses']} misses")
+        print_stages(report[name])
+
+    print("\nimports (fresh interpreter):")
+    print_stages(report["imports"])
+
+
+def print_stages(stages):
+    print(f"  {'stage':<22}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'peak KiB':>10}")
+    for stage, s in stages.items():
+        if stage == "pass":
+            continue
+        peak = f"{s['peak_bytes'] / 1024:.0f}" if "peak_bytes" in s else "-"
+        print(f"  {stage:<22}{s['runs']:>6}{s['p50'] * 1000:>10.1f}{s['p95'] * 1000:>10.1f}"
+              f"{s['p99'] * 1000:>10.1f}{s['throughput']:>10.1f}{peak:>10}")
+
+
+def parse_limits(specs):
+    """Parse --max-p95 values into (pass or None, stage) -> seconds, on top of IMPORT_LIMITS."""
+    limits = {("imports", stage): seconds for stage, seconds in IMPORT_LIMITS.items()}
+    for spec in specs:
+        target, _, seconds = spec.rpartition("=")
+        run, sep, stage = target.partition(":")
+        if not sep or run not in PASSES + ["imports"]:
+            run, stage = None, target
+        if not stage or not seconds:
+            raise SystemExit(f"Invalid --max-p95 value: {spec}")
+        if run is None:
+            limits.pop(("imports", stage), None)
+        limits[(run, stage)] = float(seconds)
+    return limits
+
+
+def check_regressions(report, limits, baseline=None, tolerance=0.25):
+    """
+    Compare the report against absolute limits and a baseline report.
+
+    Args:
+        report (dict): Report from this run
+        limits (dict): (pass or None, stage) -> maximum p95 in seconds
+        baseline (dict, optional): Report from an earlier run
+        tolerance (float): Allowed relative p95 slowdown against the baseline
+
+    Returns:
+        list: Descriptions of the failed checks
+    """
+    failures = []
+    for run, stages in report.items():
+        if run not in PASSES + ["imports"]:
+            continue
+        for stage, summary in stages.items():
+            if stage == "pass":
+                continue
+            p95 = summary["p95"]
+            for key in ((run, stage), (None, stage)):
+                if key in limits and p95 > limits[key]:
+                    failures.append(f"{run} {stage}: p95 {p95 * 1000:.1f}ms exceeds limit {limits[key] * 1000:.1f}ms")
+            if baseline:
+                before = baseline.get(run, {}).get(stage)
+                if before and p95 > before["p95"] * (1 + tolerance) and p95 - before["p95"] > NOISE_FLOOR:
+                    failures.append(f"{run} {stage}: p95 {p95 * 1000:.1f}ms regressed from "
+                                    f"{before['p95'] * 1000:.1f}ms (tolerance {tolerance:.0%})")
+    return failures
+
+
+def main():
+    args = parse_args()
+    limits = parse_limits(args.max_p95)
+
+    from fakes import FakeGenerativeModel, FakeSearchServer, install_fakes, load_corpus, prepare_workdir
+
+    prepare_workdir(prefix="benchmark-")
+    corpus = load_corpus(args.corpus) if args.corpus else None
+    server = FakeSearchServer(results_per_query=args.results, api_latency=args.api_latency,
+                              page_latency=args.page_latency, corpus=corpus)
+    server.start()
+    model = FakeGenerativeModel(latency=args.llm_latency)
+    # Keep the persistent LLM response cache so the warm pass can hit it
+    install_fakes(server, model, cache=None)
+
+    try:
+        queries = [f"benchmark query {i}" for i in range(args.queries)]
+        report = run_passes(queries, model, quiet=not args.verbose)
+    finally:
+        server.stop()
+    report["imports"] = {name: summarize(samples)
+                         for name, samples in measure_imports(IMPORT_MODULES, args.import_runs).items()}
+    report["config"] = vars(args)
+
+    print_report(report)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    failures = check_regressions(report, limits, baseline, args.tolerance) + check_lazy_imports()
+    if failures:
+        print("\nRegressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import re
+
+# Host part of an absolute or protocol-relative URL, the same one urlparse(url).hostname finds
+HOST_PATTERN = re.compile(r"^(?:[a-zA-Z][a-zA-Z0-9+.\-]*:)?//(?:[^/?#@]*@)?(?:\[([^\]/?#]*)\]|([^/?#:]*))")
+
+# Addresses hosts-file blocklists map blocked names to
+HOSTS_FILE_ADDRESSES = {"0.0.0.0", "127.0.0.1", "::", "::1"}
+
+
+def url_host(url):
+    """
+    Extract the lower-cased hostname from a URL without a full urlparse.
+
+    Args:
+        url (str): Absolute, protocol-relative or relative URL
+
+    Returns:
+        str: Hostname, or None for URLs without one (relative links, mailto:, ...)
+    """
+    match = HOST_PATTERN.match(url.strip())
+    if match is None:
+        return None
+    host = match.group(1) if match.group(1) is not None else match.group(2)
+    return host.lower() if host else None
+
+
+class DomainMatcher():
+    def __init__(self, rules=()):
+        """
+        Blocklist matcher over hostnames.
+
+        Rules are kept in two suffix hash sets, so a hostname is checked with
+        one set lookup per label. Supported rules:
+
+            tracker.com          tracker.com and all of its subdomains
+            *.tracker.com        subdomains of tracker.com only
+            ||tracker.com^       Adblock-style, same as tracker.com
+            0.0.0.0 tracker.com  hosts-file style, same as tracker.com
+
+        Blank lines and lines starting with # or ! are ignored.
+
+        Args:
+            rules (iterable): Rule strings
+        """
+        self.domains = set()
+        self.subdomains = set()
+        self.add_rules(rules)
+
+    @classmethod
+    def from_file(cls, path):
+        """Build a matcher from a blocklist file with one rule per line."""
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            return cls(f)
+
+    def add_rules(self, rules):
+        domains = self.domains
+        subdomains = self.subdomains
+        for rule in rules:
+            rule = rule.strip()
+            if not rule or rule[0] in "#!":
+                continue
+
+            # Hosts file: "0.0.0.0 tracker.com"
+            parts = rule.split()
+            if len(parts) > 1:
+                if parts[0] not in HOSTS_FILE_ADDRESSES:
+                    continue
+                rule = parts[1]
+
+            # Adblock: "||tracker.com^"
+            if rule.startswith("||"):
+                rule = rule[2:].split("^", 1)[0]
+
+            rule = rule.lower().rstrip(".")
+            if rule.startswith("*."):
+                subdomains.add(rule[2:])
+            elif rule:
+                domains.add(rule)
+
+    def __len__(self):
+        return len(self.domains) + len(self.subdomains)
+
+    def __contains__(self, host):
+        """Check whether a hostname is blocked."""
+        if not host:
+            return False
+        if host in self.domains:
+            return True
+        dot = host.find(".")
+        while dot != -1:
+            suffix = host[dot + 1:]
+            if suffix in self.domains or suffix in self.subdomains:
+                return True
+            dot = host.find(".", dot + 1)
+        return False
+
+    def count(self, urls):
+        """
+        Count the URLs pointing at blocked hosts.
+
+        Args:
+            urls (iterable): URLs, e.g. a page's script srcs and link hrefs
+
+        Returns:
+            int: Number of URLs whose host is blocked
+        """
+        seen = {}
+        total = 0
+        for url in urls:
+            host = url_host(url)
+            if host is None:
+                continue
+            blocked = seen.get(host)
+            if blocked is None:
+                blocked = seen[host] = host in self
+            total += blocked
+        return total
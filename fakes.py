@@ -0,0 +1,319 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote_plus, urlparse
+
+# Local stand-ins for the Custom Search API, result pages and Gemini, used by
+# loadtest.py and benchmark.py so they run offline and never spend API quota
+
+# Tracker hosts referenced by the generated pages; write them to a blocklist
+# to exercise the tracker filter
+TRACKER_DOMAINS = ["tracker.test", "ads.test", "analytics.test"]
+
+# Dimensions of the fake embeddings
+EMBEDDING_DIM = 64
+
+WORDS = ("search engine ranking index query relevance document crawler page content "
+         "result snippet language model semantic filter cache latency network").split()
+
+
+def stable_hash(text):
+    """Deterministic hash, unlike hash() which is salted per process."""
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def prepare_workdir(prefix="offline-"):
+    """
+    Point the database and the tracker blocklist at a new temporary directory.
+
+    Call this before importing storage, search or filter; they read the
+    paths when they are imported.
+
+    Args:
+        prefix (str): Prefix for the directory name
+
+    Returns:
+        str: The temporary directory
+    """
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    os.environ["LINKS_DB"] = os.path.join(workdir, "links.db")
+    os.environ["BLACKLIST_PATH"] = os.path.join(workdir, "blacklist.txt")
+    with open(os.environ["BLACKLIST_PATH"], "w") as f:
+        f.write("\n".join(TRACKER_DOMAINS))
+    return workdir
+
+
+def make_page(number, query):
+    """
+    Generate a deterministic result page.
+
+    Pages vary in length and in how many tracker scripts they load, so both
+    Filter passes have something to do.
+
+    Args:
+        number (int): Result number
+        query (str): Query the page is a result for
+
+    Returns:
+        str: Page HTML
+    """
+    seed = stable_hash(f"{query}:{number}")
+    words = [WORDS[(seed + i * 7) % len(WORDS)] for i in range(200 + seed % 1200)]
+    paragraphs = [" ".join(words[i:i + 60]) for i in range(0, len(words), 60)]
+    trackers = [
+        f'<script src="https://{TRACKER_DOMAINS[i % len(TRACKER_DOMAINS)]}/t{i}.js"></script>'
+        for i in range(seed % 4)
+    ]
+    links = [f'<a href="/page/{(number + i) % 100}?q={quote_plus(query)}">Related {i}</a>' for i in range(5)]
+    return (
+        f"<html><head><title>{query} result {number}</title>{''.join(trackers)}</head><body>"
+        f"<h1>{query} result {number}</h1>"
+        + "".join(f"<p>{p}</p>" for p in paragraphs)
+        + "".join(links)
+        + "</body></html>"
+    )
+
+
+def load_corpus(directory):
+    """
+    Load recorded HTML pages to serve instead of generated ones.
+
+    Args:
+        directory (str): Directory of .html files
+
+    Returns:
+        list: Page HTML, ordered by file name
+    """
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), encoding="utf-8", errors="ignore") as f:
+                pages.append(f.read())
+    return pages
+
+
+class FakeSearchServer():
+    def __init__(self, results_per_query=30, api_latency=0.0, page_latency=0.0, corpus=None, quota=None, port=0):
+        """
+        HTTP server imitating the Custom Search JSON API and the pages it links to.
+
+        /customsearch/v1?q=...&start=N returns ten items starting at N, and
+        every item links back to /page/<n> on the same server. Pages carry an
+        ETag and Last-Modified and answer conditional requests with 304.
+
+        Args:
+            results_per_query (int): Total results available for each query
+            api_latency (float): Seconds to wait before answering an API request
+            page_latency (float): Seconds to wait before serving a page
+            corpus (list, optional): Recorded page HTML to serve; defaults to generated pages
+            quota (int, optional): API requests answered before every further one gets HTTP 429
+                with a dailyLimitExceeded error
+            port (int): Port to listen on; 0 picks a free one
+        """
+        self.results_per_query = results_per_query
+        self.api_latency = api_latency
+        self.page_latency = page_latency
+        self.corpus = corpus
+        self.quota = quota
+        self.api_requests = 0
+        self.page_requests = 0
+        self.not_modified = 0
+        self.started = formatdate(usegmt=True)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def search_url(self):
+        """URL template in the format search.SEARCH_URL uses."""
+        return self.url + "/customsearch/v1?key={key}&cx={cx}&q={query}&start={start}"
+
+    def start(self):
+        """Serve requests from a background thread and return the base URL."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def page(self, number, query):
+        if self.corpus:
+            return self.corpus[number % len(self.corpus)]
+        return make_page(number, query)
+
+    def items(self, query, start):
+        numbers = range(start, min(start + 10, self.results_per_query + 1))
+        return [{
+            "link": f"{self.url}/page/{n}?q={quote_plus(query)}",
+            "title": f"{query} result {n}",
+            "snippet": f"Result {n} about {query}.",
+        } for n in numbers]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                query = params.get("q", [""])[0]
+                headers = {}
+                status = 200
+
+                if url.path == "/customsearch/v1":
+                    with server._lock:
+                        server.api_requests += 1
+                        over_quota = server.quota is not None and server.api_requests > server.quota
+                    if over_quota:
+                        # Shaped like the real API's error body, which search.quota_reason reads
+                        status = 429
+                        body = json.dumps({"error": {"code": 429, "message": "Quota exceeded", "errors": [
+                            {"message": "Quota exceeded", "domain": "usageLimits", "reason": "dailyLimitExceeded"}
+                        ]}}).encode("utf-8")
+                    else:
+                        time.sleep(server.api_latency)
+                        start = int(params.get("start", ["1"])[0])
+                        items = server.items(query, start)
+                        # The real API leaves out "items" past the last result
+                        body = json.dumps({"items": items} if items else {}).encode("utf-8")
+                    content_type = "application/json"
+                elif url.path.startswith("/page/"):
+                    with server._lock:
+                        server.page_requests += 1
+                    time.sleep(server.page_latency)
+                    body = server.page(int(url.path.rsplit("/", 1)[1]), query).encode("utf-8")
+                    content_type = "text/html; charset=utf-8"
+                    etag = f'"{zlib.crc32(body):08x}"'
+                    headers["ETag"] = etag
+                    headers["Last-Modified"] = server.started
+                    if self.headers.get("If-None-Match") == etag:
+                        with server._lock:
+                            server.not_modified += 1
+                        self.send_response(304)
+                        for name, value in headers.items():
+                            self.send_header(name, value)
+                        self.end_headers()
+                        return
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class FakeResponse():
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel():
+    def __init__(self, latency=0.0):
+        """
+        Stand-in for genai.GenerativeModel that answers GeminiEnhancer's prompts.
+
+        Answers are deterministic and in the format each prompt asks for.
+
+        Args:
+            latency (float): Seconds every call takes
+        """
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def respond(self, prompt):
+        with self._lock:
+            self.calls += 1
+
+        if "Enhanced query:" in prompt:
+            query = re.search(r"Original query: (.*)", prompt).group(1).strip()
+            return f"{query} overview guide"
+        if "<document number>: <score>" in prompt:
+            documents = re.findall(r"Document (\d+)\nTitle: (.*)", prompt)
+            return "\n".join(f"{n}: {stable_hash(title) % 101 / 10}" for n, title in documents)
+        if "how relevant is this document" in prompt:
+            title = re.search(r"Document Title: (.*)", prompt).group(1)
+            return str(stable_hash(title) % 101 / 10)
+        if '"FILTER" or "KEEP"' in prompt:
+            return "KEEP"
+        if "Page Content:" in prompt:
+            return "A concise, factual summary of the page generated for offline testing."
+        return ""
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        return FakeResponse(self.respond(prompt))
+
+    async def generate_content_async(self, prompt):
+        await asyncio.sleep(self.latency)
+        return FakeResponse(self.respond(prompt))
+
+    def embed(self, texts, task_type=None):
+        """
+        Stand-in for genai.embed_content: hashed bag-of-words vectors.
+
+        Texts sharing words get similar vectors, so cosine ranking behaves plausibly.
+
+        Args:
+            texts (list): Texts to embed
+            task_type (str, optional): Ignored
+
+        Returns:
+            list: One EMBEDDING_DIM vector per text
+        """
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        vectors = []
+        for text in texts:
+            vector = [0.0] * EMBEDDING_DIM
+            for word in text.lower().split():
+                vector[stable_hash(word) % EMBEDDING_DIM] += 1.0
+            vectors.append(vector)
+        return vectors
+
+
+def install_fakes(server, model, cache=False):
+    """
+    Point the search pipeline at a FakeSearchServer and a FakeGenerativeModel.
+
+    Args:
+        server (FakeSearchServer): Started search server
+        model (FakeGenerativeModel): Model the Gemini enhancers should call
+        cache (ResponseCache, optional): LLM response cache; False disables it
+    """
+    import search
+    from gemini_integration import AsyncGeminiEnhancer, GeminiEnhancer
+
+    # search() only calls Gemini when a key is configured
+    os.environ["GEMINI_API_KEY"] = os.environ.get("GEMINI_API_KEY") or "fake"
+    search.SEARCH_URL = server.search_url
+    search.SEARCH_KEY = "fake"
+    search.SEARCH_ID = "fake"
+    search._gemini = GeminiEnhancer(cache=cache, model=model, embedder=model.embed)
+    search._async_gemini = AsyncGeminiEnhancer(cache=cache, model=model, embedder=model.embed)
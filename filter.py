@@ -1,35 +1,102 @@
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+import atexit
+import multiprocessing
+import os
+import threading
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from settings import *
+from storage import page_html, pages_html
+from page_parser import parse_page
+from domain_matcher import DomainMatcher
+from metrics import timed
 
-with open("blacklist.txt") as f:
-    bad_domain_list = set(f.read().split('\n'))
+# Tracker blocklist, one rule per line
+BLACKLIST_PATH = os.getenv("BLACKLIST_PATH", "blacklist.txt")
 
-def tracker_urls(row):
-    soup = BeautifulSoup(row["html"])
-    scripts = soup.find_all("script", {"src": True})
-    srcs = [s.get("src") for s in scripts]
+_bad_domains = None
+_bad_domains_lock = threading.Lock()
+
+def get_bad_domains():
+    """Load the tracker blocklist on first use. Blocked domains also block their subdomains."""
+    global _bad_domains
+    with _bad_domains_lock:
+        if _bad_domains is None:
+            _bad_domains = DomainMatcher.from_file(BLACKLIST_PATH)
+    return _bad_domains
+
+def __getattr__(name):
+    # Keep filter.bad_domain_list working without loading it at import time
+    if name == "bad_domain_list":
+        return get_bad_domains()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Worker processes for page parsing; 0 parses in the calling thread
+FILTER_WORKERS = int(os.getenv("FILTER_WORKERS", "0"))
+# Below this many pages, process start-up and pickling cost more than they save
+FILTER_PARALLEL_MIN = int(os.getenv("FILTER_PARALLEL_MIN", "20"))
+
+_executors = {}     # worker count -> process pool
+_executor_lock = threading.Lock()
+
+def pool_context():
+    # The host process runs many threads (Streamlit, uvicorn, sqlite, background
+    # workers), which fork can deadlock on; start workers from a clean process
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
 
-    links = soup.find_all("a", {"href": True})
-    href = [l.get("href") for l in links]
+def get_executor(workers):
+    """Return the shared parsing process pool with this many workers, creating it on first use."""
+    with _executor_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            executor = _executors[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+            atexit.register(executor.shutdown, wait=False, cancel_futures=True)
+        return executor
 
-    all_domains = [urlparse(s).hostname for s in srcs + href]
-    # Fixed variable name: bad_domains -> bad_domains_found
-    bad_domains_found = [a for a in all_domains if a in bad_domain_list]
-    return len(bad_domains_found)
+def page_features(row):
+    return parse_page(page_html(row))
+
+def count_trackers(page):
+    return get_bad_domains().count(page.script_srcs + page.hrefs)
+
+def tracker_urls(row):
+    return count_trackers(page_features(row))
 
 def get_page_content(row):
-    soup = BeautifulSoup(row['html'])
-    text = soup.get_text()
-    return text
+    return page_features(row).text
 
 class Filter():
-    def __init__(self, results):
+    def __init__(self, results, workers=None):
+        """
+        Re-rank search results by page content and tracker usage.
+
+        Args:
+            results (DataFrame): Search results
+            workers (int, optional): Worker processes for parsing pages. Defaults to
+                FILTER_WORKERS; inputs smaller than FILTER_PARALLEL_MIN are always parsed serially.
+        """
         self.filtered = results.copy()
+        self.workers = FILTER_WORKERS if workers is None else workers
+        self._pages = None
+
+    @timed("parse_pages", count=len)
+    def parse_pages(self):
+        # HTML may be loaded from storage, which stays in this process
+        html = pages_html(self.filtered)
+        if self.workers > 1 and len(html) >= FILTER_PARALLEL_MIN:
+            chunksize = max(1, len(html) // (self.workers * 4))
+            return list(get_executor(self.workers).map(parse_page, html, chunksize=chunksize))
+        return [parse_page(page) for page in html]
+
+    @property
+    def pages(self):
+        # Parse every page once; all filters read from the same parse
+        if self._pages is None:
+            self._pages = pd.Series(self.parse_pages(), index=self.filtered.index, dtype=object)
+        return self._pages
 
     def content_filter(self):
-        page_content = self.filtered.apply(get_page_content, axis=1)
-        word_count = page_content.apply(lambda x: len(x.split(" ")))
+        word_count = pd.Series([page.word_count for page in self.pages], index=self.pages.index, dtype=float)
         word_count /= word_count.median()
 
         word_count[word_count <= .5] = RESULT_COUNT
@@ -37,10 +104,11 @@ class Filter():
         self.filtered["rank"] += word_count
 
     def tracker_filter(self):
-        tracker_count = self.filtered.apply(tracker_urls, axis=1)
+        tracker_count = pd.Series([count_trackers(page) for page in self.pages], index=self.pages.index, dtype=int)
         tracker_count[tracker_count > tracker_count.median()] = RESULT_COUNT * 2
         self.filtered["rank"] += tracker_count
 
+    @timed("filter", count=len)
     def filter(self):
         self.content_filter()
         self.tracker_filter()
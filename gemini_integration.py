@@ -1,55 +1,137 @@
-import google.generativeai as genai
-from google.ai import generativelanguage as glm
-import pandas as pd
+import asyncio
 import os
+import re
+import threading
+import time
+import weakref
+import numpy as np
 from dotenv import load_dotenv
+from storage import ResponseCache, VectorIndex, pages_html
+from page_parser import parse_page
+from metrics import increment, timed
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API
+# Gemini API key; the client library is imported and configured on first use by get_genai()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     print("Warning: GEMINI_API_KEY not found in .env file. Gemini features will not work.")
-else:
-    genai.configure(api_key=GEMINI_API_KEY)
 
+# Limits for the async enhancer
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))   # Requests in flight
+GEMINI_RATE_LIMIT = float(os.getenv("GEMINI_RATE_LIMIT", "10"))          # Requests per second
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))                      # Requests allowed back to back
 
-class GeminiEnhancer:
-    def __init__(self):
-        """Initialize the Gemini model for various search enhancements."""
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+# Response cache
+GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_CACHE_TTL = float(os.getenv("GEMINI_CACHE_TTL", str(7 * 24 * 3600)))  # Seconds
+GEMINI_CACHE_SIZE = int(os.getenv("GEMINI_CACHE_SIZE", "10000"))           # Entries
 
-    def expand_query(self, query, country=None):
+# Ranking: "llm" scores every result with Gemini, "embedding" by cosine similarity of embeddings
+RANKING_MODE = os.getenv("RANKING_MODE", "llm")
+GEMINI_EMBED_MODEL = os.getenv("GEMINI_EMBED_MODEL", "models/text-embedding-004")
+EMBED_BATCH_SIZE = 100      # Texts per embedding request, the API maximum
+EMBED_PAGE_CHARS = 2000     # Page text included in a document's embedding
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "0"))   # Top results re-scored by Gemini in embedding mode; 0 disables
+
+# Matches "<document number>: <score>" lines in a batched scoring response
+BATCH_SCORE_PATTERN = re.compile(r"^\s*(?:Document\s*)?(\d+)\s*[:=\-]\s*(\d+(?:\.\d+)?)", re.MULTILINE | re.IGNORECASE)
+
+
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def get_genai():
+    """Import and configure google.generativeai, which is slow to import, on first use."""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            if GEMINI_API_KEY:
+                genai.configure(api_key=GEMINI_API_KEY)
+            _genai = genai
+    return _genai
+
+
+class GeminiEnhancer:
+    def __init__(self, cache=None, model=None, embedder=None, ranking_mode=RANKING_MODE):
         """
-        Expand the user query to improve search results by adding relevant terms.
-        Includes country context if provided.
+        Initialize the Gemini model for various search enhancements.
 
         Args:
-            query (str): Original user query
-            country (str, optional): Two-letter country code for location context
-
-        Returns:
-            str: Expanded query with additional relevant terms
+            cache (ResponseCache, optional): Response cache to use. Defaults to a
+                persistent cache in links.db; pass False to disable caching.
+            model (optional): Object with generate_content and generate_content_async
+                to use instead of the Gemini model, e.g. fakes.FakeGenerativeModel
+            embedder (callable, optional): Called with a list of texts and a task type, returns
+                one vector per text; used instead of the Gemini embedding API
+            ranking_mode (str): llm or embedding, see rank_results
         """
+        self.model_name = GEMINI_MODEL
+        self.model = model if model is not None else get_genai().GenerativeModel(self.model_name)
+        if cache is None:
+            cache = ResponseCache(ttl=GEMINI_CACHE_TTL, max_entries=GEMINI_CACHE_SIZE)
+        self.cache = cache or None
+        self.embed_model_name = GEMINI_EMBED_MODEL
+        self.embedder = embedder
+        self.ranking_mode = ranking_mode
+        self._vector_index = None
+
+    @property
+    def enhanced_by(self):
+        """Models behind the enhancements; stored results enhanced by others are scored again."""
+        if self.ranking_mode == "embedding":
+            return f"{self.model_name}+{self.embed_model_name}"
+        return self.model_name
+
+    @property
+    def vector_index(self):
+        # Created on first use so LLM ranking never touches the embeddings table
+        if self._vector_index is None:
+            self._vector_index = VectorIndex()
+        return self._vector_index
+
+    def _cached(self, prompt):
+        if self.cache is None:
+            return None
+        text = self.cache.get(self.model_name, prompt)
+        increment("llm_cache_hits" if text is not None else "llm_cache_misses")
+        return text
+
+    def _remember(self, prompt, text):
+        if self.cache is not None:
+            self.cache.put(self.model_name, prompt, text)
+        return text
+
+    def _generate(self, prompt):
+        text = self._cached(prompt)
+        if text is not None:
+            return text
+        increment("llm_calls", model=self.model_name)
+        response = self.model.generate_content(prompt)
+        return self._remember(prompt, response.text)
+
+    def _expand_prompt(self, query, country=None):
         country_context = ""
         if country and len(country) == 2:
             country_context = f"The searcher is located in country with code {country.upper()}. "
             country_context += "Optimize the query expansion for relevance to this location when appropriate."
 
-        prompt = f"""
-        You are an expert search query enhancer. Your task is to expand the following search query 
+        return f"""
+        You are an expert search query enhancer. Your task is to expand the following search query
         to improve search results. Add relevant terms that would help find the most accurate information.
         Keep the expanded query concise and focused on the original intent.
         {country_context}
 
         Original query: {query}
 
-        Enhanced query: 
+        Enhanced query:
         """
 
-        response = self.model.generate_content(prompt)
-        expanded_query = response.text.strip()
+    def _parse_expansion(self, text):
+        expanded_query = text.strip()
 
         # Ensure we don't get an overly complex query
         if len(expanded_query.split()) > 15:
@@ -59,13 +141,220 @@ class GeminiEnhancer:
 
         return expanded_query
 
-    def rank_results_semantically(self, query, results_df):
+    def _document_score_prompt(self, query, row):
+        # Create a relevance assessment prompt
+        return f"""
+        Query: {query}
+
+        Document Title: {row['title']}
+        Document Snippet: {row['snippet']}
+
+        On a scale from 0.0 to 10.0, how relevant is this document to the query?
+        Provide only a numeric score without any explanation.
+        """
+
+    def _parse_document_score(self, text):
+        # Extract numeric value from response
+        try:
+            score = float(text.strip())
+            # Ensure score is within bounds
+            return max(0.0, min(10.0, score))
+        except ValueError:
+            # If we can't parse a number, use a default score
+            return 5.0
+
+    def _batch_score_prompt(self, query, batch):
+        positions = {}
+        documents = []
+        for number, (idx, row) in enumerate(batch.iterrows(), start=1):
+            positions[number] = idx
+            documents.append(
+                f"Document {number}\n"
+                f"Title: {row['title']}\n"
+                f"Snippet: {row['snippet']}"
+            )
+        documents_text = "\n\n".join(documents)
+
+        prompt = f"""
+        Query: {query}
+
+        {documents_text}
+
+        On a scale from 0.0 to 10.0, how relevant is each document to the query?
+        Answer with one line per document in the form "<document number>: <score>",
+        for example "1: 7.5". Provide no other text.
+        """
+        return prompt, positions
+
+    def _parse_batch_scores(self, text, positions):
+        scores = {}
+        for match in BATCH_SCORE_PATTERN.finditer(text):
+            number = int(match.group(1))
+            if number in positions and positions[number] not in scores:
+                score = float(match.group(2))
+                # Ensure score is within bounds
+                scores[positions[number]] = max(0.0, min(10.0, score))
+        return scores
+
+    def _apply_semantic_scores(self, enhanced_df):
+        # Adjust the rank based on semantic score
+        # The lower the rank number, the better (rank 1 is best)
+        # So we subtract the semantic score from the current rank
+        enhanced_df['rank'] = enhanced_df['rank'] - (enhanced_df['semantic_score'] / 2)
+
+        # Ensure rank values are positive
+        enhanced_df['rank'] = enhanced_df['rank'].apply(lambda x: max(0.1, x))
+
+        return enhanced_df
+
+    def _document_text(self, row, html):
+        text = f"{row['title']}\n{row['snippet']}"
+        if html:
+            # Reuses the parse shared with Filter
+            text += "\n" + " ".join(parse_page(html).text.split())[:EMBED_PAGE_CHARS]
+        return text
+
+    @staticmethod
+    def cosine_scores(query_vector, document_vectors):
+        """
+        Score documents by cosine similarity to the query.
+
+        Args:
+            query_vector (ndarray): Query embedding
+            document_vectors (ndarray): One document embedding per row
+
+        Returns:
+            ndarray: Scores from 0.0 to 10.0, like the LLM relevance scores
+        """
+        norms = np.linalg.norm(document_vectors, axis=1) * np.linalg.norm(query_vector)
+        similarity = np.divide(document_vectors @ query_vector, norms,
+                               out=np.zeros(len(document_vectors), dtype=np.float32), where=norms > 0)
+        return np.clip(similarity, 0.0, 1.0) * 10.0
+
+    def _rerank_candidates(self, enhanced_df, top_k):
+        return enhanced_df.sort_values('semantic_score', ascending=False).head(top_k)
+
+    def _needs_filter_check(self, row):
+        # Skip if semantic score is already high
+        return row.get('semantic_score', 0) < 7.0
+
+    def _with_verdicts(self, results_df):
+        # Results that skip the check are kept; failed checks stay unknown
+        filtered_df = results_df.copy()
+        filtered_df['filter_verdict'] = None
+        keep = [not self._needs_filter_check(row) for _, row in filtered_df.iterrows()]
+        filtered_df.loc[keep, 'filter_verdict'] = "KEEP"
+        return filtered_df
+
+    def _filter_prompt(self, row):
+        return f"""
+            Document Title: {row['title']}
+            Document Snippet: {row['snippet']}
+
+            Analyze if this content appears to be:
+            1. Spam
+            2. Content farm (low quality)
+            3. Misleading
+            4. Irrelevant to most searches
+
+            Respond with either "FILTER" or "KEEP" without explanation.
+            """
+
+    def _with_snippet_source(self, results_df):
+        enhanced_df = results_df.copy()
+        if 'snippet_source' not in enhanced_df:
+            enhanced_df['snippet_source'] = "api"
+        return enhanced_df
+
+    def _snippet_candidates(self, enhanced_df):
+        # Process only the top results to save API calls
+        top_results = enhanced_df.sort_values('rank').head(5)
+        candidates = []
+        for idx, html in zip(top_results.index, pages_html(top_results)):
+            # Only process if we have HTML content
+            if len(html) > 100:
+                # Reuses the parse shared with Filter
+                candidates.append((idx, parse_page(html).text))
+        return candidates
+
+    def _snippet_prompt(self, text):
+        # Collapse the whitespace left behind by markup
+        text = " ".join(text.split())
+        return f"""
+                Extract the most informative, concise summary from this page content.
+                Create a snippet that is informative, factual, and directly addresses the likely user intent.
+                Keep it under 200 characters.
+
+                Page Content: {text[:10000]}  # Limit content to first 10K chars
+                """
+
+    def _parse_snippet(self, text):
+        improved_snippet = text.strip()
+
+        # Only use the snippet if we got a good response
+        if len(improved_snippet) > 20 and len(improved_snippet) < 250:
+            return improved_snippet
+        return None
+
+    @timed("expand_query")
+    def expand_query(self, query, country=None):
+        """
+        Expand the user query to improve search results by adding relevant terms.
+        Includes country context if provided.
+
+        Args:
+            query (str): Original user query
+            country (str, optional): Two-letter country code for location context
+
+        Returns:
+            str: Expanded query with additional relevant terms
+        """
+        return self._parse_expansion(self._generate(self._expand_prompt(query, country)))
+
+    def score_document(self, query, row):
+        """
+        Score a single document's relevance to the query with its own request.
+
+        Args:
+            query (str): User query
+            row (Series): Search result with 'title' and 'snippet'
+
+        Returns:
+            float: Relevance score between 0.0 and 10.0
+        """
+        return self._parse_document_score(self._generate(self._document_score_prompt(query, row)))
+
+    def score_batch(self, query, batch):
+        """
+        Score a slice of documents with a single request.
+
+        Args:
+            query (str): User query
+            batch (DataFrame): Search results with 'title' and 'snippet'
+
+        Returns:
+            dict: Relevance score for each document index that could be parsed
+                  from the response. Documents missing from the dict need scoring
+                  on their own.
+        """
+        prompt, positions = self._batch_score_prompt(query, batch)
+        return self._parse_batch_scores(self._generate(prompt), positions)
+
+    @timed("rank_semantically", count=len)
+    def rank_results_semantically(self, query, results_df, batch_size=10):
         """
         Rank search results based on semantic relevance to the query.
 
+        Results are scored a batch at a time with one request per batch.
+        Documents whose score can't be read from the batch response are
+        scored individually. If the batch request itself fails, its
+        documents get the neutral score 5.0 rather than one request each
+        against an API that is already failing.
+
         Args:
             query (str): User query
             results_df (DataFrame): DataFrame containing search results
+            batch_size (int): Number of documents scored per request
 
         Returns:
             DataFrame: Results with semantic relevance scores
@@ -76,49 +365,131 @@ class GeminiEnhancer:
         # Add a semantic_score column
         enhanced_df['semantic_score'] = 0.0
 
-        # Process in batches to avoid rate limits
-        batch_size = 5
         for i in range(0, len(enhanced_df), batch_size):
             batch = enhanced_df.iloc[i:i + batch_size]
 
-            for idx, row in batch.iterrows():
-                # Create a relevance assessment prompt
-                prompt = f"""
-                Query: {query}
-
-                Document Title: {row['title']}
-                Document Snippet: {row['snippet']}
+            try:
+                scores = self.score_batch(query, batch)
+            except Exception as e:
+                print(f"Error scoring batch starting at result {i}: {e}")
+                scores = {idx: 5.0 for idx in batch.index}
 
-                On a scale from 0.0 to 10.0, how relevant is this document to the query?
-                Provide only a numeric score without any explanation.
-                """
+            for idx, row in batch.iterrows():
+                if idx in scores:
+                    enhanced_df.at[idx, 'semantic_score'] = scores[idx]
+                    continue
 
+                # Fall back to scoring this document on its own
                 try:
-                    response = self.model.generate_content(prompt)
-                    score_text = response.text.strip()
-                    # Extract numeric value from response
-                    try:
-                        score = float(score_text)
-                        # Ensure score is within bounds
-                        score = max(0.0, min(10.0, score))
-                        enhanced_df.at[idx, 'semantic_score'] = score
-                    except ValueError:
-                        # If we can't parse a number, use a default score
-                        enhanced_df.at[idx, 'semantic_score'] = 5.0
+                    enhanced_df.at[idx, 'semantic_score'] = self.score_document(query, row)
                 except Exception as e:
                     print(f"Error scoring result {idx}: {e}")
                     enhanced_df.at[idx, 'semantic_score'] = 5.0
 
-        # Adjust the rank based on semantic score
-        # The lower the rank number, the better (rank 1 is best)
-        # So we subtract the semantic score from the current rank
-        enhanced_df['rank'] = enhanced_df['rank'] - (enhanced_df['semantic_score'] / 2)
+        return self._apply_semantic_scores(enhanced_df)
 
-        # Ensure rank values are positive
-        enhanced_df['rank'] = enhanced_df['rank'].apply(lambda x: max(0.1, x))
+    def _embed_batch(self, texts, task_type):
+        increment("embedding_calls", model=self.embed_model_name)
+        if self.embedder is not None:
+            return self.embedder(texts, task_type)
+        return get_genai().embed_content(model=self.embed_model_name, content=texts, task_type=task_type)["embedding"]
 
-        return enhanced_df
+    def embed(self, texts, task_type="retrieval_document"):
+        """
+        Embed texts, EMBED_BATCH_SIZE per request.
+
+        Args:
+            texts (list): Texts to embed
+            task_type (str): retrieval_document or retrieval_query
+
+        Returns:
+            ndarray: float32 matrix with one row per text
+        """
+        vectors = []
+        for i in range(0, len(texts), EMBED_BATCH_SIZE):
+            vectors.extend(self._embed_batch(texts[i:i + EMBED_BATCH_SIZE], task_type))
+        return np.asarray(vectors, dtype=np.float32)
+
+    def document_vectors(self, results_df):
+        """
+        Embed each result's title, snippet and page text, reusing vectors from the local index.
+
+        Args:
+            results_df (DataFrame): Search results with 'link', 'title' and 'snippet'
 
+        Returns:
+            ndarray: float32 matrix with one row per result, in results_df order
+        """
+        html = pages_html(results_df)
+        texts = {row['link']: self._document_text(row, page)
+                 for (_, row), page in zip(results_df.iterrows(), html)}
+        vectors = self.vector_index.get_many(self.embed_model_name, texts)
+        increment("embedding_index_hits", len(vectors))
+        increment("embedding_index_misses", len(texts) - len(vectors))
+
+        missing = [link for link in texts if link not in vectors]
+        if missing:
+            embedded = dict(zip(missing, self.embed([texts[link] for link in missing])))
+            self.vector_index.put_many(self.embed_model_name, texts, embedded)
+            vectors.update(embedded)
+        return np.vstack([vectors[link] for link in results_df['link']])
+
+    @timed("rank_embedding", count=len)
+    def rank_results_by_embedding(self, query, results_df, rerank_top_k=RERANK_TOP_K):
+        """
+        Rank search results by embedding similarity to the query.
+
+        Documents are scored without any LLM request. Optionally, the top
+        results are then re-scored by Gemini in a single batch request.
+
+        Args:
+            query (str): User query
+            results_df (DataFrame): DataFrame containing search results
+            rerank_top_k (int): Number of top results to re-score with Gemini; 0 disables
+
+        Returns:
+            DataFrame: Results with semantic relevance scores
+        """
+        enhanced_df = results_df.copy()
+        enhanced_df['semantic_score'] = 0.0
+        if enhanced_df.empty:
+            return enhanced_df
+
+        query_vector = self.embed([query], task_type="retrieval_query")[0]
+        enhanced_df['semantic_score'] = self.cosine_scores(query_vector, self.document_vectors(enhanced_df))
+
+        if rerank_top_k > 0:
+            try:
+                scores = self.score_batch(query, self._rerank_candidates(enhanced_df, rerank_top_k))
+            except Exception as e:
+                print(f"Error re-ranking top results: {e}")
+                scores = {}
+            for idx, score in scores.items():
+                enhanced_df.at[idx, 'semantic_score'] = score
+
+        return self._apply_semantic_scores(enhanced_df)
+
+    def rank_results(self, query, results_df):
+        """
+        Rank search results with the configured ranking mode.
+
+        Embedding ranking falls back to LLM scoring if the embedding requests fail.
+
+        Args:
+            query (str): User query
+            results_df (DataFrame): DataFrame containing search results
+
+        Returns:
+            DataFrame: Results with semantic relevance scores
+        """
+        if self.ranking_mode == "embedding":
+            try:
+                return self.rank_results_by_embedding(query, results_df)
+            except Exception as e:
+                print(f"Error in embedding ranking, falling back to LLM scoring: {e}")
+        return self.rank_results_semantically(query, results_df)
+
+    @timed("filter_content", count=len)
     def filter_content(self, results_df):
         """
         Filter out low-quality or irrelevant content from search results.
@@ -129,30 +500,16 @@ class GeminiEnhancer:
         Returns:
             DataFrame: Filtered results
         """
-        filtered_df = results_df.copy()
+        filtered_df = self._with_verdicts(results_df)
 
         # For each result, assess if it should be filtered out
         for idx, row in filtered_df.iterrows():
-            # Skip if semantic score is already high
-            if row.get('semantic_score', 0) >= 7.0:
+            if not self._needs_filter_check(row):
                 continue
 
-            prompt = f"""
-            Document Title: {row['title']}
-            Document Snippet: {row['snippet']}
-
-            Analyze if this content appears to be:
-            1. Spam
-            2. Content farm (low quality)
-            3. Misleading
-            4. Irrelevant to most searches
-
-            Respond with either "FILTER" or "KEEP" without explanation.
-            """
-
             try:
-                response = self.model.generate_content(prompt)
-                decision = response.text.strip().upper()
+                decision = self._generate(self._filter_prompt(row)).strip().upper()
+                filtered_df.at[idx, 'filter_verdict'] = "FILTER" if decision == "FILTER" else "KEEP"
 
                 if decision == "FILTER":
                     # Increase rank significantly (worse result)
@@ -162,6 +519,7 @@ class GeminiEnhancer:
 
         return filtered_df
 
+    @timed("snippets", count=len)
     def generate_improved_snippets(self, results_df):
         """
         Generate improved snippets for search results.
@@ -172,29 +530,318 @@ class GeminiEnhancer:
         Returns:
             DataFrame: Results with improved snippets
         """
-        enhanced_df = results_df.copy()
+        enhanced_df = self._with_snippet_source(results_df)
 
-        # Process only the top results to save API calls
-        top_results = enhanced_df.sort_values('rank').head(5)
+        for idx, text in self._snippet_candidates(enhanced_df):
+            try:
+                improved_snippet = self._parse_snippet(self._generate(self._snippet_prompt(text)))
 
-        for idx, row in top_results.iterrows():
-            if len(row['html']) > 100:  # Only process if we have HTML content
-                prompt = f"""
-                Extract the most informative, concise summary from this HTML content.
-                Create a snippet that is informative, factual, and directly addresses the likely user intent.
-                Keep it under 200 characters.
+                # Update the snippet if we got a good response
+                if improved_snippet is not None:
+                    enhanced_df.at[idx, 'snippet'] = improved_snippet
+                    enhanced_df.at[idx, 'snippet_source'] = "gemini"
+            except Exception as e:
+                print(f"Error generating snippet for result {idx}: {e}")
 
-                HTML Content: {row['html'][:10000]}  # Limit HTML to first 10K chars
-                """
+        return enhanced_df
 
-                try:
-                    response = self.model.generate_content(prompt)
-                    improved_snippet = response.text.strip()
 
-                    # Update the snippet if we got a good response
-                    if len(improved_snippet) > 20 and len(improved_snippet) < 250:
-                        enhanced_df.at[idx, 'snippet'] = improved_snippet
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        Token-bucket rate limiter for coroutines.
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (int): Maximum number of tokens the bucket holds
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncGeminiEnhancer(GeminiEnhancer):
+    def __init__(self, max_concurrency=GEMINI_MAX_CONCURRENCY, rate_limit=GEMINI_RATE_LIMIT, burst=GEMINI_BURST,
+                 cache=None, model=None, embedder=None, ranking_mode=RANKING_MODE):
+        """
+        Asynchronous variant of GeminiEnhancer.
+
+        Independent per-document requests run concurrently, bounded by
+        max_concurrency requests in flight and rate_limit requests per second.
+
+        Args:
+            max_concurrency (int): Maximum number of requests in flight
+            rate_limit (float): Sustained requests per second
+            burst (int): Requests allowed back to back before rate limiting applies
+            cache (ResponseCache, optional): Response cache, as for GeminiEnhancer
+            model (optional): Model to use instead of the Gemini model, as for GeminiEnhancer
+            embedder (callable, optional): Embedding function, as for GeminiEnhancer
+            ranking_mode (str): llm or embedding, as for GeminiEnhancer
+        """
+        super().__init__(cache=cache, model=model, embedder=embedder, ranking_mode=ranking_mode)
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self._limits = weakref.WeakKeyDictionary()   # event loop -> (semaphore, bucket)
+        self._limits_lock = threading.Lock()
+
+    def _loop_limits(self):
+        # asyncio primitives are bound to the loop they are first used on,
+        # so keep one semaphore and bucket per event loop; closed loops drop out
+        loop = asyncio.get_running_loop()
+        with self._limits_lock:
+            limits = self._limits.get(loop)
+            if limits is None:
+                limits = self._limits[loop] = (asyncio.Semaphore(self.max_concurrency),
+                                               TokenBucket(self.rate_limit, self.burst))
+            return limits
+
+    async def _generate_async(self, prompt):
+        # The response cache is sqlite; keep its reads and writes off the event loop
+        text = await asyncio.to_thread(self._cached, prompt)
+        if text is not None:
+            return text
+        semaphore, bucket = self._loop_limits()
+        async with semaphore:
+            await bucket.acquire()
+            increment("llm_calls", model=self.model_name)
+            response = await self.model.generate_content_async(prompt)
+            return await asyncio.to_thread(self._remember, prompt, response.text)
+
+    @timed("expand_query")
+    async def expand_query(self, query, country=None):
+        """
+        Expand the user query to improve search results by adding relevant terms.
+
+        Args:
+            query (str): Original user query
+            country (str, optional): Two-letter country code for location context
+
+        Returns:
+            str: Expanded query with additional relevant terms
+        """
+        return self._parse_expansion(await self._generate_async(self._expand_prompt(query, country)))
+
+    async def score_document(self, query, row):
+        """
+        Score a single document's relevance to the query with its own request.
+
+        Args:
+            query (str): User query
+            row (Series): Search result with 'title' and 'snippet'
+
+        Returns:
+            float: Relevance score between 0.0 and 10.0
+        """
+        return self._parse_document_score(await self._generate_async(self._document_score_prompt(query, row)))
+
+    async def score_batch(self, query, batch):
+        """
+        Score a slice of documents with a single request.
+
+        Args:
+            query (str): User query
+            batch (DataFrame): Search results with 'title' and 'snippet'
+
+        Returns:
+            dict: Relevance score for each document index that could be parsed
+        """
+        prompt, positions = self._batch_score_prompt(query, batch)
+        return self._parse_batch_scores(await self._generate_async(prompt), positions)
+
+    @timed("rank_semantically", count=len)
+    async def rank_results_semantically(self, query, results_df, batch_size=10):
+        """
+        Rank search results based on semantic relevance to the query.
+
+        All batches are scored concurrently, as are the per-document
+        fallbacks for documents missing from a batch response. A batch
+        whose request fails gets the neutral score 5.0.
+
+        Args:
+            query (str): User query
+            results_df (DataFrame): DataFrame containing search results
+            batch_size (int): Number of documents scored per request
+
+        Returns:
+            DataFrame: Results with semantic relevance scores
+        """
+        enhanced_df = results_df.copy()
+        enhanced_df['semantic_score'] = 0.0
+
+        async def score_slice(i):
+            batch = enhanced_df.iloc[i:i + batch_size]
+            try:
+                scores = await self.score_batch(query, batch)
+            except Exception as e:
+                print(f"Error scoring batch starting at result {i}: {e}")
+                scores = {idx: 5.0 for idx in batch.index}
+
+            async def fallback(idx, row):
+                try:
+                    scores[idx] = await self.score_document(query, row)
                 except Exception as e:
-                    print(f"Error generating snippet for result {idx}: {e}")
+                    print(f"Error scoring result {idx}: {e}")
+                    scores[idx] = 5.0
+
+            await asyncio.gather(*(fallback(idx, row) for idx, row in batch.iterrows() if idx not in scores))
+            return scores
+
+        for scores in await asyncio.gather(*(score_slice(i) for i in range(0, len(enhanced_df), batch_size))):
+            for idx, score in scores.items():
+                enhanced_df.at[idx, 'semantic_score'] = score
+
+        return self._apply_semantic_scores(enhanced_df)
+
+    @timed("rank_embedding", count=len)
+    async def rank_results_by_embedding(self, query, results_df, rerank_top_k=RERANK_TOP_K):
+        """
+        Rank search results by embedding similarity to the query.
+
+        The embedding requests and the index lookups run in worker threads.
+
+        Args:
+            query (str): User query
+            results_df (DataFrame): DataFrame containing search results
+            rerank_top_k (int): Number of top results to re-score with Gemini; 0 disables
+
+        Returns:
+            DataFrame: Results with semantic relevance scores
+        """
+        enhanced_df = results_df.copy()
+        enhanced_df['semantic_score'] = 0.0
+        if enhanced_df.empty:
+            return enhanced_df
+
+        query_vectors, document_vectors = await asyncio.gather(
+            asyncio.to_thread(self.embed, [query], "retrieval_query"),
+            asyncio.to_thread(self.document_vectors, enhanced_df),
+        )
+        enhanced_df['semantic_score'] = self.cosine_scores(query_vectors[0], document_vectors)
+
+        if rerank_top_k > 0:
+            try:
+                scores = await self.score_batch(query, self._rerank_candidates(enhanced_df, rerank_top_k))
+            except Exception as e:
+                print(f"Error re-ranking top results: {e}")
+                scores = {}
+            for idx, score in scores.items():
+                enhanced_df.at[idx, 'semantic_score'] = score
+
+        return self._apply_semantic_scores(enhanced_df)
+
+    async def rank_results(self, query, results_df):
+        """
+        Rank search results with the configured ranking mode.
+
+        Args:
+            query (str): User query
+            results_df (DataFrame): DataFrame containing search results
+
+        Returns:
+            DataFrame: Results with semantic relevance scores
+        """
+        if self.ranking_mode == "embedding":
+            try:
+                return await self.rank_results_by_embedding(query, results_df)
+            except Exception as e:
+                print(f"Error in embedding ranking, falling back to LLM scoring: {e}")
+        return await self.rank_results_semantically(query, results_df)
+
+    @timed("filter_content", count=len)
+    async def filter_content(self, results_df):
+        """
+        Filter out low-quality or irrelevant content from search results.
 
-        return enhanced_df
\ No newline at end of file
+        Args:
+            results_df (DataFrame): DataFrame containing search results
+
+        Returns:
+            DataFrame: Filtered results
+        """
+        filtered_df = self._with_verdicts(results_df)
+
+        async def check(idx, row):
+            try:
+                decision = (await self._generate_async(self._filter_prompt(row))).strip().upper()
+                return idx, decision
+            except Exception as e:
+                print(f"Error filtering result {idx}: {e}")
+                return idx, None
+
+        checks = [check(idx, row) for idx, row in filtered_df.iterrows() if self._needs_filter_check(row)]
+        for idx, decision in await asyncio.gather(*checks):
+            if decision is not None:
+                filtered_df.at[idx, 'filter_verdict'] = "FILTER" if decision == "FILTER" else "KEEP"
+            if decision == "FILTER":
+                # Increase rank significantly (worse result)
+                filtered_df.at[idx, 'rank'] = filtered_df.at[idx, 'rank'] + 50
+
+        return filtered_df
+
+    @timed("snippets", count=len)
+    async def generate_improved_snippets(self, results_df):
+        """
+        Generate improved snippets for search results.
+
+        Args:
+            results_df (DataFrame): DataFrame containing search results
+
+        Returns:
+            DataFrame: Results with improved snippets
+        """
+        enhanced_df = self._with_snippet_source(results_df)
+
+        async def summarize(idx, text):
+            try:
+                return idx, self._parse_snippet(await self._generate_async(self._snippet_prompt(text)))
+            except Exception as e:
+                print(f"Error generating snippet for result {idx}: {e}")
+                return idx, None
+
+        # Loading and parsing the pages is sqlite and CPU work; keep it off the event loop
+        candidates = await asyncio.to_thread(self._snippet_candidates, enhanced_df)
+        snippets = await asyncio.gather(*(summarize(idx, text) for idx, text in candidates))
+        for idx, improved_snippet in snippets:
+            if improved_snippet is not None:
+                enhanced_df.at[idx, 'snippet'] = improved_snippet
+                enhanced_df.at[idx, 'snippet_source'] = "gemini"
+
+        return enhanced_df
+
+    async def enhance(self, query, results_df):
+        """
+        Run semantic ranking, then content filtering and snippet generation concurrently.
+
+        Snippets are generated for the top results after semantic ranking,
+        since filtering and summarization don't depend on each other.
+
+        Args:
+            query (str): User query
+            results_df (DataFrame): DataFrame containing search results
+
+        Returns:
+            DataFrame: Ranked, filtered results with improved snippets, sorted by rank
+        """
+        ranked_df = await self.rank_results(query, results_df)
+        filtered_df, snippets_df = await asyncio.gather(
+            self.filter_content(ranked_df),
+            self.generate_improved_snippets(ranked_df),
+        )
+        filtered_df['snippet'] = snippets_df['snippet']
+        filtered_df['snippet_source'] = snippets_df['snippet_source']
+        return filtered_df.sort_values("rank", ascending=True)
@@ -0,0 +1,88 @@
+"""
+Load test for the JSON API against local stand-ins for Google and Gemini.
+
+    python loadtest.py --requests 500 --concurrency 50 --queries 20 --llm-latency 0.2
+
+Nothing leaves the machine: the Custom Search API and the result pages come
+from fakes.FakeSearchServer, Gemini from fakes.FakeGenerativeModel, and the
+database and blocklist live in a temporary directory.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Total requests to send")
+    parser.add_argument("--concurrency", type=int, default=20, help="Requests in flight at once")
+    parser.add_argument("--queries", type=int, default=10, help="Distinct queries to cycle through")
+    parser.add_argument("--results", type=int, default=30, help="Results the fake API returns per query")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Fake search API latency in seconds")
+    parser.add_argument("--page-latency", type=float, default=0.02, help="Fake page latency in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.1, help="Fake Gemini latency in seconds")
+    return parser.parse_args()
+
+
+async def run(args, app):
+    import httpx
+
+    latencies = []
+    statuses = Counter()
+    slots = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        async def one(i):
+            async with slots:
+                started = time.perf_counter()
+                response = await client.get("/search", params={"q": f"load test query {i % args.queries}"})
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - started
+        health = (await client.get("/health")).json()
+
+    return sorted(latencies), statuses, elapsed, health
+
+
+def main():
+    args = parse_args()
+
+    from benchmark import percentile
+    from fakes import FakeGenerativeModel, FakeSearchServer, install_fakes, prepare_workdir
+
+    # Keep the database and blocklist out of the working directory
+    prepare_workdir(prefix="loadtest-")
+
+    server = FakeSearchServer(results_per_query=args.results, api_latency=args.api_latency,
+                              page_latency=args.page_latency)
+    server.start()
+    model = FakeGenerativeModel(latency=args.llm_latency)
+    install_fakes(server, model)
+
+    from api import app
+
+    try:
+        latencies, statuses, elapsed, health = asyncio.run(run(args, app))
+    finally:
+        server.stop()
+
+    print(f"Requests:    {args.requests} ({args.concurrency} concurrent, {args.queries} distinct queries)")
+    print(f"Elapsed:     {elapsed:.2f}s ({args.requests / elapsed:.1f} req/s)")
+    print(f"Statuses:    {dict(sorted(statuses.items()))}")
+    print(f"Latency:     p50 {percentile(latencies, 50) * 1000:.0f}ms  "
+          f"p95 {percentile(latencies, 95) * 1000:.0f}ms  "
+          f"p99 {percentile(latencies, 99) * 1000:.0f}ms  "
+          f"mean {statistics.mean(latencies) * 1000:.0f}ms")
+    print(f"Upstream:    {server.api_requests} search API calls, {server.page_requests} page fetches, "
+          f"{model.calls} Gemini calls")
+    print(f"Cache:       {health['cache']}")
+
+
+if __name__ == "__main__":
+    main()
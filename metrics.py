@@ -0,0 +1,298 @@
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# none, prometheus or json
+METRICS_SINK = os.getenv("METRICS_SINK", "none")
+# File the json sink appends to; defaults to stderr
+METRICS_LOG = os.getenv("METRICS_LOG")
+
+# Histogram buckets for span durations, in seconds
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+
+class NullSink():
+    """Discards everything. Spans are skipped entirely while it is installed."""
+    enabled = False
+
+    def record_span(self, name, seconds, count=None, labels=None):
+        pass
+
+    def increment(self, name, value=1, labels=None):
+        pass
+
+
+class PrometheusSink():
+    enabled = True
+
+    def __init__(self, namespace="deathstroke", buckets=SPAN_BUCKETS):
+        """
+        Aggregates spans and counters in memory and renders them in the Prometheus text format.
+
+        Spans become the <namespace>_stage_seconds histogram and the
+        <namespace>_stage_items_total counter, labelled by stage. Counters
+        become <namespace>_<name>_total; for every <x>_hits/<x>_misses pair
+        a <namespace>_<x>_hit_ratio gauge is rendered as well.
+
+        Args:
+            namespace (str): Prefix for every metric name
+            buckets (tuple): Histogram bucket upper bounds in seconds, ending with inf
+        """
+        self.namespace = namespace
+        self.buckets = buckets
+        self._histograms = {}                   # labels -> [bucket counts, sum, count]
+        self._items = defaultdict(float)        # labels -> items processed
+        self._counters = defaultdict(float)     # (name, labels) -> value
+        self._lock = threading.Lock()
+
+    def record_span(self, name, seconds, count=None, labels=None):
+        key = (("stage", name),) + tuple(sorted((labels or {}).items()))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+            if count is not None:
+                self._items[key] += count
+
+    def increment(self, name, value=1, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        ns = self.namespace
+        lines = []
+        with self._lock:
+            if self._histograms:
+                lines.append(f"# HELP {ns}_stage_seconds Time spent in each search pipeline stage")
+                lines.append(f"# TYPE {ns}_stage_seconds histogram")
+                for key, (buckets, total, count) in sorted(self._histograms.items()):
+                    for bound, bucket_count in zip(self.buckets, buckets):
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{ns}_stage_seconds_bucket{format_labels(key + (('le', le),))} {bucket_count}")
+                    lines.append(f"{ns}_stage_seconds_sum{format_labels(key)} {total}")
+                    lines.append(f"{ns}_stage_seconds_count{format_labels(key)} {count}")
+            if self._items:
+                lines.append(f"# TYPE {ns}_stage_items_total counter")
+                for key, value in sorted(self._items.items()):
+                    lines.append(f"{ns}_stage_items_total{format_labels(key)} {value}")
+
+            by_name = defaultdict(dict)
+            for (name, labels), value in self._counters.items():
+                by_name[name][labels] = value
+            for name in sorted(by_name):
+                lines.append(f"# TYPE {ns}_{name}_total counter")
+                for labels, value in sorted(by_name[name].items()):
+                    lines.append(f"{ns}_{name}_total{format_labels(labels)} {value}")
+
+            for name in sorted(by_name):
+                if not name.endswith("_hits"):
+                    continue
+                prefix = name[:-len("_hits")]
+                misses = by_name.get(prefix + "_misses", {})
+                lines.append(f"# TYPE {ns}_{prefix}_hit_ratio gauge")
+                for labels, hits in sorted(by_name[name].items()):
+                    total = hits + misses.get(labels, 0)
+                    lines.append(f"{ns}_{prefix}_hit_ratio{format_labels(labels)} {hits / total if total else 0.0}")
+        return "\n".join(lines) + "\n"
+
+
+class JsonLogSink():
+    enabled = True
+
+    def __init__(self, stream=None):
+        """
+        Writes every span and counter increment as one JSON object per line.
+
+        Args:
+            stream (file, optional): Text stream to write to. Defaults to stderr.
+        """
+        self.stream = stream or sys.stderr
+        self._lock = threading.Lock()
+
+    def _write(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def record_span(self, name, seconds, count=None, labels=None):
+        event = {"ts": time.time(), "type": "span", "name": name, "seconds": round(seconds, 6)}
+        if count is not None:
+            event["count"] = count
+        if labels:
+            event["labels"] = labels
+        self._write(event)
+
+    def increment(self, name, value=1, labels=None):
+        event = {"ts": time.time(), "type": "counter", "name": name, "value": value}
+        if labels:
+            event["labels"] = labels
+        self._write(event)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+def make_sink(kind):
+    """
+    Create a sink by name.
+
+    Args:
+        kind (str): none, prometheus or json
+
+    Returns:
+        NullSink, PrometheusSink or JsonLogSink
+    """
+    if kind == "prometheus":
+        return PrometheusSink()
+    if kind == "json":
+        return JsonLogSink(open(METRICS_LOG, "a") if METRICS_LOG else None)
+    return NullSink()
+
+
+_sink = make_sink(METRICS_SINK)
+
+
+def get_sink():
+    """Return the installed metrics sink."""
+    return _sink
+
+
+def set_sink(sink):
+    """
+    Install a metrics sink for the whole process.
+
+    Args:
+        sink: Object with an enabled attribute, record_span() and increment(),
+              e.g. NullSink, PrometheusSink or JsonLogSink
+    """
+    global _sink
+    _sink = sink
+
+
+class Span():
+    def __init__(self, sink, name, labels):
+        self.sink = sink
+        self.name = name
+        self.labels = labels
+        self.count = None   # Set inside the block to record how many items the stage handled
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = self.labels
+        if exc_type is not None:
+            labels = dict(labels, error=exc_type.__name__)
+        self.sink.record_span(self.name, time.perf_counter() - self.started, self.count, labels)
+        return False
+
+
+class _NullSpan():
+    count = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **labels):
+    """
+    Time a block of code as a pipeline stage.
+
+        with span("scrape_page") as s:
+            html = scrape(links)
+            s.count = len(html)
+
+    Costs one attribute check while no sink is installed.
+
+    Args:
+        name (str): Stage name
+        **labels: Extra labels to record with the span
+
+    Returns:
+        Context manager yielding the span
+    """
+    sink = _sink
+    if not sink.enabled:
+        return _NULL_SPAN
+    return Span(sink, name, labels)
+
+
+def increment(name, value=1, **labels):
+    """
+    Add to a counter, e.g. increment("llm_calls", model="gemini-2.0-flash").
+
+    Args:
+        name (str): Counter name; pair <x>_hits with <x>_misses to get a hit ratio
+        value (float): Amount to add
+        **labels: Labels for the counter
+    """
+    sink = _sink
+    if sink.enabled:
+        sink.increment(name, value, labels)
+
+
+def timed(name, count=None):
+    """
+    Decorator recording every call of a function, or coroutine function, as a span.
+
+    Args:
+        name (str): Stage name
+        count (callable, optional): Called with the return value to get the item count
+
+    Returns:
+        Decorator
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _sink.enabled:
+                    return await func(*args, **kwargs)
+                with span(name) as s:
+                    result = await func(*args, **kwargs)
+                    if count is not None:
+                        s.count = count(result)
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sink.enabled:
+                return func(*args, **kwargs)
+            with span(name) as s:
+                result = func(*args, **kwargs)
+                if count is not None:
+                    s.count = count(result)
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from bs4 import BeautifulSoup
+
+# selectolax and lxml are optional, faster alternatives to html.parser
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        # selectolax before 1.0 only has the Modest backend
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+# auto, selectolax, lxml or html.parser
+HTML_PARSER = os.getenv("HTML_PARSER", "auto")
+BACKENDS = ("auto", "selectolax", "lxml", "html.parser")
+
+# Parsed pages kept in memory, keyed by a digest so the HTML itself isn't held on to
+PARSE_CACHE_SIZE = 32
+
+# Everything the filters and snippet generation need from a page
+ParsedPage = namedtuple("ParsedPage", ["text", "word_count", "script_srcs", "hrefs"])
+
+
+def available_backend(backend=None):
+    """
+    Resolve a parser backend name.
+
+    Args:
+        backend (str, optional): auto, selectolax, lxml or html.parser. Defaults to HTML_PARSER.
+
+    Returns:
+        str: The backend that will be used; auto picks the fastest one installed
+
+    Raises:
+        ValueError: If backend isn't one of BACKENDS
+        ImportError: If backend names a parser that isn't installed
+    """
+    backend = backend or HTML_PARSER
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown HTML parser {backend!r}, expected one of {', '.join(BACKENDS)}")
+    if backend == "auto":
+        if HTMLParser is not None:
+            return "selectolax"
+        if lxml is not None:
+            return "lxml"
+        return "html.parser"
+    if (backend == "selectolax" and HTMLParser is None) or (backend == "lxml" and lxml is None):
+        raise ImportError(f"HTML parser {backend!r} was requested, but the {backend} package is not installed")
+    return backend
+
+
+def _parse_selectolax(html):
+    tree = HTMLParser(html)
+    script_srcs = [node.attributes.get("src") for node in tree.css("script[src]")]
+    hrefs = [node.attributes.get("href") for node in tree.css("a[href]")]
+    # Match BeautifulSoup.get_text(), which leaves out script and style contents
+    tree.strip_tags(["script", "style", "template"])
+    text = tree.root.text(separator="") if tree.root is not None else ""
+    return text, script_srcs, hrefs
+
+
+def _parse_soup(html, features):
+    soup = BeautifulSoup(html, features)
+    script_srcs = [s.get("src") for s in soup.find_all("script", {"src": True})]
+    hrefs = [l.get("href") for l in soup.find_all("a", {"href": True})]
+    return soup.get_text(), script_srcs, hrefs
+
+
+_parsed = OrderedDict()     # (HTML digest, backend) -> ParsedPage, least recently used first
+_parsed_lock = threading.Lock()
+
+
+def _parse(html, backend):
+    if backend == "selectolax":
+        text, script_srcs, hrefs = _parse_selectolax(html)
+    else:
+        text, script_srcs, hrefs = _parse_soup(html, backend)
+    return ParsedPage(
+        text=text,
+        word_count=len(text.split(" ")),
+        script_srcs=tuple(src for src in script_srcs if src),
+        hrefs=tuple(href for href in hrefs if href),
+    )
+
+
+def parse_page(html, backend=None):
+    """
+    Parse a page once and extract its text, word count, script srcs and link hrefs.
+
+    Recent results are cached by a digest of the HTML, so the filters and
+    snippet generation share a single parse of each page.
+
+    Args:
+        html (str): Page HTML
+        backend (str, optional): Parser backend, see available_backend
+
+    Returns:
+        ParsedPage: Extracted page features
+    """
+    html = html or ""
+    backend = available_backend(backend)
+    key = (hashlib.sha1(html.encode("utf-8", "surrogatepass")).hexdigest(), backend)
+    with _parsed_lock:
+        parsed = _parsed.get(key)
+        if parsed is not None:
+            _parsed.move_to_end(key)
+            return parsed
+    parsed = _parse(html, backend)
+    with _parsed_lock:
+        _parsed[key] = parsed
+        while len(_parsed) > PARSE_CACHE_SIZE:
+            _parsed.popitem(last=False)
+    return parsed
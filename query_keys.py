@@ -0,0 +1,133 @@
+import hashlib
+import os
+import random
+import unicodedata
+
+# Words that don't change what a query is about
+STOPWORDS = frozenset("""
+    a an and are as at be by for from how i in is it me my of on or the to
+    vs what when where which who why will with
+""".split())
+
+# Reuse the stored results of a similar earlier query at or above this similarity; 0 disables
+QUERY_SIMILARITY_THRESHOLD = float(os.getenv("QUERY_SIMILARITY_THRESHOLD", "0"))
+
+# MinHash signature: MINHASH_BANDS bands of MINHASH_PERMUTATIONS / MINHASH_BANDS rows each.
+# With 16 bands of 4 rows, queries with a similarity of 0.6 share a band 89% of the time.
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+SHINGLE_SIZE = 3
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(2024)   # Fixed seed: signatures are stored and must stay comparable
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(MINHASH_PERMUTATIONS)]
+
+
+def query_tokens(query):
+    """
+    Split a query into NFKC-normalized, case-folded words.
+
+    Words are split on whitespace only, so symbols stay part of them and
+    "C++", "C#" and "C" remain different words.
+    """
+    return unicodedata.normalize("NFKC", query).casefold().split()
+
+
+def normalize_query(query):
+    """
+    Reduce a query to a canonical key.
+
+    Case, Unicode width and compatibility forms, whitespace, stopwords and
+    word order are ignored, so "Python Programming", "python  programming "
+    and "programming in Python" all share one key. Symbols are kept, so
+    "C++ vs C#" and "C vs C++" don't. Stopwords are only dropped if at
+    least two other words remain; otherwise "to be or not to be" would
+    share the key of "not".
+
+    Args:
+        query (str): Query as typed
+
+    Returns:
+        str: Normalized key
+    """
+    tokens = query_tokens(query)
+    content = [token for token in tokens if token not in STOPWORDS]
+    if len(set(content)) < 2:
+        content = tokens
+    return " ".join(sorted(content))
+
+
+def make_query_id(query, country=None):
+    """Create a unique identifier for a query + country combination."""
+    key = normalize_query(query)
+    if country:
+        return f"{key}__country_{country}"
+    return key
+
+
+def split_query_id(query_id):
+    """
+    Split a query ID into its query and country.
+
+    Args:
+        query_id (str): Identifier from make_query_id, or a raw query stored before normalization
+
+    Returns:
+        tuple: (query, country), country None for global searches
+    """
+    query, separator, country = query_id.rpartition("__country_")
+    if not separator:
+        return query_id, None
+    return query, country or None
+
+
+def shingles(key):
+    """Character shingles of a normalized key; catch plurals and small typos that word sets miss."""
+    text = f" {key} "
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(a, b):
+    """Jaccard similarity of two sets."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(shingle_set):
+    """
+    MinHash signature of a set of shingles.
+
+    Args:
+        shingle_set (set): Shingles from shingles()
+
+    Returns:
+        list: MINHASH_PERMUTATIONS integers
+    """
+    values = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+              for s in shingle_set]
+    return [min((a * value + b) % _MERSENNE_PRIME for value in values) for a, b in _PERMUTATIONS]
+
+
+def lsh_buckets(signature):
+    """
+    Locality-sensitive hash buckets of a signature, one per band.
+
+    Similar queries are likely to share at least one bucket, so candidates
+    are found with an index lookup instead of comparing against every query.
+
+    Args:
+        signature (list): Signature from minhash()
+
+    Returns:
+        list: (band, bucket) pairs
+    """
+    rows = len(signature) // MINHASH_BANDS
+    buckets = []
+    for band in range(MINHASH_BANDS):
+        chunk = ",".join(str(value) for value in signature[band * rows:(band + 1) * rows])
+        buckets.append((band, hashlib.blake2b(chunk.encode("ascii"), digest_size=8).hexdigest()))
+    return buckets
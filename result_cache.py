@@ -0,0 +1,178 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import increment
+
+# Defaults for the shared result cache
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "600"))              # Seconds
+RESULT_CACHE_MB = float(os.getenv("RESULT_CACHE_MB", "256"))                # Memory budget in MB
+
+
+def estimate_size(value):
+    """Estimate the memory used by a cached value in bytes."""
+    if hasattr(value, "memory_usage"):
+        # DataFrame: count the strings in object columns too
+        return int(value.memory_usage(deep=True).sum())
+    return sys.getsizeof(value)
+
+
+class _Abandoned(Exception):
+    """Tells callers waiting on a computation that its owner gave up on it."""
+
+
+class ResultCache():
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_bytes=int(RESULT_CACHE_MB * 1024 * 1024)):
+        """
+        Thread-safe in-memory cache with TTL, a memory budget and LRU eviction.
+
+        get_or_compute() coalesces concurrent requests for the same key, so
+        a value is computed once no matter how many callers ask for it at
+        the same time (single-flight).
+
+        Args:
+            ttl (float): Seconds an entry stays valid
+            max_bytes (int): Memory budget; least recently used entries are evicted beyond it
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (expires, size, value)
+        self._inflight = {}             # key -> Future for the computation in progress
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, size, value = entry
+        if expires < now:
+            del self._entries[key]
+            self.bytes -= size
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        """
+        Look up a value.
+
+        Args:
+            key (hashable): Cache key
+
+        Returns:
+            The cached value, or None if it's missing or expired
+        """
+        with self._lock:
+            entry = self._get(key, time.monotonic())
+            if entry is None:
+                self.misses += 1
+                increment("result_cache_misses")
+                return None
+            self.hits += 1
+            increment("result_cache_hits")
+            return entry[2]
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the least recently used entries to stay within the memory budget.
+
+        Values larger than the whole budget are not cached.
+
+        Args:
+            key (hashable): Cache key
+            value: Value to cache; treat it as read-only once cached
+        """
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def invalidate(self, key):
+        """Drop a key from the cache."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, computing it if needed.
+
+        If another thread is already computing the same key, wait for its
+        result instead of starting a second computation. If that computation
+        is interrupted by something other than an Exception (e.g.
+        KeyboardInterrupt or a Streamlit rerun), one of the waiting threads
+        takes it over.
+
+        Args:
+            key (hashable): Cache key
+            compute (callable): Called with no arguments to produce the value
+
+        Returns:
+            The cached or computed value
+
+        Raises:
+            Exception: Whatever compute raised; waiting callers get the same exception
+        """
+        while True:
+            with self._lock:
+                entry = self._get(key, time.monotonic())
+                if entry is not None:
+                    self.hits += 1
+                    increment("result_cache_hits")
+                    return entry[2]
+                self.misses += 1
+                increment("result_cache_misses")
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = self._inflight[key] = Future()
+
+            if not owner:
+                try:
+                    return future.result()
+                except _Abandoned:
+                    # The owner was interrupted; try to take over
+                    continue
+
+            try:
+                value = compute()
+                self.put(key, value)
+            except BaseException as e:
+                self._release(key)
+                # Only the computation's own errors are shared; anything else concerns the owner alone
+                future.set_exception(e if isinstance(e, Exception) else _Abandoned())
+                raise
+            self._release(key)
+            future.set_result(value)
+            return value
+
+    def _release(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        """Return entry count, memory used, and hit and miss counts."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
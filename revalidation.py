@@ -0,0 +1,75 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import increment
+
+# Background refreshes running at once
+REFRESH_WORKERS = int(os.getenv("REFRESH_WORKERS", "2"))
+
+
+class Revalidator():
+    def __init__(self, workers=REFRESH_WORKERS):
+        """
+        Runs background refreshes of stale results, at most one per key at a time.
+
+        A refresh requested while one for the same key is queued or running
+        joins it instead of starting another, so a burst of requests for a
+        stale query costs a single refetch.
+
+        Args:
+            workers (int): Refreshes running at once
+        """
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="revalidate")
+        self._inflight = {}     # key -> Future of the refresh queued or running
+        self._lock = threading.Lock()
+
+    def _run(self, key, task, args):
+        try:
+            return task(*args)
+        except Exception as e:
+            print(f"Error refreshing {key}: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def submit(self, key, task, *args):
+        """
+        Schedule task(*args) unless a refresh for key is already queued or running.
+
+        Args:
+            key (hashable): What is being refreshed, e.g. a query ID
+            task (callable): Performs the refresh
+            *args: Arguments for task
+
+        Returns:
+            Future: The new refresh, or the one already in flight for key
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                increment("refresh_deduplicated")
+                return future
+            # _run removes the key under the same lock, so it can't finish before it's registered
+            future = self._inflight[key] = self._executor.submit(self._run, key, task, args)
+            increment("refresh_scheduled")
+            return future
+
+    def pending(self):
+        """Number of refreshes queued or running."""
+        with self._lock:
+            return len(self._inflight)
+
+
+_revalidator = None
+_revalidator_lock = threading.Lock()
+
+
+def get_revalidator():
+    """Return the process-wide Revalidator, creating it on first use."""
+    global _revalidator
+    with _revalidator_lock:
+        if _revalidator is None:
+            _revalidator = Revalidator()
+        return _revalidator
@@ -0,0 +1,267 @@
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+from metrics import increment
+
+# Scraping limits
+SCRAPE_WORKERS = 10        # Total concurrent downloads
+SCRAPE_PER_HOST = 2        # Concurrent downloads against a single host
+SCRAPE_TIMEOUT = 5         # Per-request timeout in seconds
+SCRAPE_DEADLINE = 15       # Overall time budget for one batch of links in seconds
+HOST_POLL = 0.05           # Seconds between checks for a free slot on hosts busy with other batches
+
+# Retry policy for transient API failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5        # Seconds, doubled after every failed attempt
+
+# A downloaded page with its cache validators. not_modified means the server
+# answered 304 to a conditional request, so html is empty and the stored copy is current.
+FetchedPage = namedtuple("FetchedPage", ["html", "etag", "last_modified", "not_modified"])
+EMPTY_PAGE = FetchedPage("", None, None, False)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the process-wide HTTP session.
+
+    The session keeps connections alive between requests so repeated
+    calls to the same hosts don't pay for a new TCP/TLS handshake.
+
+    Returns:
+        requests.Session: Shared session with a pooled adapter
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=SCRAPE_WORKERS, pool_maxsize=SCRAPE_WORKERS)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def get_with_retry(url, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF, cancelled=None,
+                   retry_statuses=RETRY_STATUSES, retryable=None, **kwargs):
+    """
+    GET a URL over the shared session, retrying transient failures with exponential backoff.
+
+    Args:
+        url (str): URL to request
+        attempts (int): Maximum number of attempts
+        backoff (float): Delay before the first retry, doubled after every attempt
+        cancelled (callable, optional): Checked before every retry; stops retrying once it returns True
+        retry_statuses (set): HTTP statuses worth retrying
+        retryable (callable, optional): Called with a response whose status is in retry_statuses;
+            returning False hands that response back without retrying
+        **kwargs: Passed through to requests.Session.get
+
+    Returns:
+        requests.Response: The last response received
+
+    Raises:
+        RequestException: If every attempt failed at the connection level
+    """
+    session = get_session()
+    delay = backoff
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        try:
+            response = session.get(url, **kwargs)
+            if response.status_code not in retry_statuses or last_attempt:
+                return response
+            if retryable is not None and not retryable(response):
+                return response
+        except RequestException:
+            if last_attempt:
+                raise
+        increment("http_retries")
+        time.sleep(delay)
+        delay *= 2
+        if cancelled is not None and cancelled():
+            break
+    raise RequestException(f"Request cancelled: {url}")
+
+
+class Scraper():
+    def __init__(self, workers=SCRAPE_WORKERS, per_host=SCRAPE_PER_HOST,
+                 timeout=SCRAPE_TIMEOUT, deadline=SCRAPE_DEADLINE):
+        """
+        Concurrent page downloader.
+
+        Args:
+            workers (int): Maximum number of downloads in flight
+            per_host (int): Maximum number of downloads in flight against one host
+            timeout (float): Per-request timeout in seconds
+            deadline (float): Time budget for a whole call to scrape() in seconds
+        """
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.deadline = deadline
+        self.session = get_session()
+        self._host_limits = {}      # host -> [semaphore, downloads waiting or running]
+        self._host_lock = threading.Lock()
+
+    def _host_semaphore(self, host):
+        """Return the semaphore limiting downloads from host; pair every call with _release_host."""
+        with self._host_lock:
+            entry = self._host_limits.get(host)
+            if entry is None:
+                entry = self._host_limits[host] = [threading.BoundedSemaphore(self.per_host), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _release_host(self, host):
+        # Drop the semaphores of idle hosts so a long-running process doesn't keep one per host ever seen
+        with self._host_lock:
+            entry = self._host_limits[host]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._host_limits[host]
+
+    def fetch_page(self, link, stop_at, validators=None):
+        """
+        Download a single page, honouring the per-host limit and the batch deadline.
+
+        Args:
+            link (str): URL to download
+            stop_at (float): time.monotonic() value after which the download is skipped
+            validators (tuple, optional): (etag, last_modified) of the stored copy; the
+                request is then conditional and an unchanged page isn't downloaded again
+
+        Returns:
+            FetchedPage: Page HTML and validators, EMPTY_PAGE on failure
+        """
+        host = urlparse(link).hostname or ""
+        semaphore = self._host_semaphore(host)
+        try:
+            remaining = stop_at - time.monotonic()
+            if remaining <= 0 or not semaphore.acquire(timeout=remaining):
+                return EMPTY_PAGE
+            try:
+                return self._request(link, stop_at, validators)
+            finally:
+                semaphore.release()
+        finally:
+            self._release_host(host)
+
+    def _download(self, link, host, semaphore, stop_at, validators):
+        # Runs on a worker once scrape_pages got link a slot on its host
+        try:
+            return self._request(link, stop_at, validators)
+        finally:
+            semaphore.release()
+            self._release_host(host)
+
+    def _request(self, link, stop_at, validators):
+        try:
+            remaining = stop_at - time.monotonic()
+            if remaining <= 0:
+                return EMPTY_PAGE
+            headers = {}
+            etag, last_modified = validators or (None, None)
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            data = self.session.get(link, timeout=min(self.timeout, remaining), headers=headers or None)
+            if data.status_code == 304 and headers:
+                increment("scrape_not_modified")
+                return FetchedPage("", etag, last_modified, True)
+            return FetchedPage(data.text, data.headers.get("ETag"), data.headers.get("Last-Modified"), False)
+        except RequestException:
+            return EMPTY_PAGE
+
+    def fetch(self, link, stop_at):
+        """Download a single page; see fetch_page. Returns its HTML, or an empty string on failure."""
+        return self.fetch_page(link, stop_at).html
+
+    def scrape_pages(self, links, validators=None):
+        """
+        Download all links concurrently.
+
+        A link is only handed to a worker once its host has a free slot, so
+        links waiting on a busy host never hold workers that downloads from
+        other hosts could use.
+
+        Args:
+            links (list): List of URLs to scrape
+            validators (dict, optional): (etag, last_modified) for links with a stored
+                copy; those are requested conditionally
+
+        Returns:
+            list: FetchedPage for each link, in the same order as links.
+                  Links that fail or miss the deadline get EMPTY_PAGE.
+        """
+        links = list(links)
+        if not links:
+            return []
+        validators = validators or {}
+
+        stop_at = time.monotonic() + self.deadline
+        pages = [EMPTY_PAGE] * len(links)
+        pending = {}    # host -> indexes of links not dispatched yet, in order
+        for i, link in enumerate(links):
+            pending.setdefault(urlparse(link).hostname or "", deque()).append(i)
+
+        workers = min(self.workers, len(links))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        running = {}    # future -> link index
+        try:
+            while pending or running:
+                remaining = stop_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                for host in list(pending):
+                    # Fill the host's free slots, as far as workers are free
+                    while host in pending and len(running) < workers:
+                        semaphore = self._host_semaphore(host)
+                        if not semaphore.acquire(blocking=False):
+                            self._release_host(host)
+                            break
+                        i = pending[host].popleft()
+                        if not pending[host]:
+                            del pending[host]
+                        future = executor.submit(self._download, links[i], host, semaphore, stop_at,
+                                                 validators.get(links[i]))
+                        running[future] = i
+                # Wake up when a download finishes, or to retry hosts busy with other batches
+                if running:
+                    done, _ = wait(running, timeout=min(remaining, HOST_POLL), return_when=FIRST_COMPLETED)
+                else:
+                    done = ()
+                    time.sleep(min(remaining, HOST_POLL))
+                for future in done:
+                    i = running.pop(future)
+                    if future.exception() is None:
+                        pages[i] = future.result()
+        finally:
+            # Don't let a slow host hold the caller past the deadline
+            executor.shutdown(wait=False, cancel_futures=True)
+        return pages
+
+    def scrape(self, links):
+        """
+        Download all links concurrently.
+
+        Args:
+            links (list): List of URLs to scrape
+
+        Returns:
+            list: HTML content for each link, in the same order as links.
+                  Links that fail or miss the deadline get an empty string.
+        """
+        return [page.html for page in self.scrape_pages(links)]
@@ -1,17 +1,119 @@
 from http.client import responses
 from time import strftime
-from datetime import datetime
+from datetime import datetime, timedelta
 from settings import *
+import asyncio
 import os
-import requests
-from requests.exceptions import RequestException
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-from storage import DBStorage
+from storage import get_storage
 from urllib.parse import quote_plus
-from gemini_integration import GeminiEnhancer
+from scraper import Scraper, get_with_retry
+from metrics import increment, timed
+from query_keys import QUERY_SIMILARITY_THRESHOLD, make_query_id, normalize_query, query_tokens
+from revalidation import get_revalidator
+
+# The Gemini enhancers and the scraper are created on first use by the getters
+# below, so importing this module stays cheap
+_gemini = None
+_async_gemini = None
+_scraper = None
+_lazy_lock = threading.Lock()
+
+
+def get_gemini():
+    """Return the shared GeminiEnhancer, creating it on first use."""
+    global _gemini
+    with _lazy_lock:
+        if _gemini is None:
+            from gemini_integration import GeminiEnhancer
+            _gemini = GeminiEnhancer()
+    return _gemini
+
+
+def get_async_gemini():
+    """Return the shared AsyncGeminiEnhancer, creating it on first use."""
+    global _async_gemini
+    with _lazy_lock:
+        if _async_gemini is None:
+            from gemini_integration import AsyncGeminiEnhancer
+            _async_gemini = AsyncGeminiEnhancer()
+    return _async_gemini
+
+
+def get_scraper():
+    """Return the shared scraper: pooled session, bounded workers and an overall deadline."""
+    global _scraper
+    with _lazy_lock:
+        if _scraper is None:
+            _scraper = Scraper()
+    return _scraper
+
+
+def __getattr__(name):
+    # Keep search.gemini, search.async_gemini and search.scraper working
+    getters = {"gemini": get_gemini, "async_gemini": get_async_gemini, "scraper": get_scraper}
+    if name in getters:
+        return getters[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Stored Gemini enhancements are reused for this many seconds
+ENHANCEMENT_TTL = float(os.getenv("ENHANCEMENT_TTL", str(7 * 24 * 3600)))
+
+# Stored results are served as they are for RESULTS_TTL seconds (RESULTS_FRESH_TTL for
+# time-sensitive queries). After that they are stale: still served, but refreshed in the
+# background. Past the TTL plus RESULTS_MAX_STALE they have expired and are refetched
+# before answering. A RESULTS_TTL of 0 or less keeps stored results forever.
+RESULTS_TTL = float(os.getenv("RESULTS_TTL", str(24 * 3600)))
+RESULTS_FRESH_TTL = float(os.getenv("RESULTS_FRESH_TTL", "3600"))
+RESULTS_MAX_STALE = float(os.getenv("RESULTS_MAX_STALE", str(7 * 24 * 3600)))
+
+# Words that make a query time-sensitive, so its results go stale after RESULTS_FRESH_TTL
+TIME_SENSITIVE_WORDS = frozenset("""
+    breaking latest live news now price prices score scores stock today tonight update weather
+""".split())
+
+# Seconds a single Custom Search request may take
+SEARCH_API_TIMEOUT = float(os.getenv("SEARCH_API_TIMEOUT", "10"))
+
+# Error reasons the search API gives once the daily quota is used up. Retrying
+# them only spends more requests before the local fallback; other 429s are
+# retried and count as an exhausted quota once the retries run out.
+QUOTA_REASONS = {"dailyLimitExceeded", "quotaExceeded"}
+
+# web queries the search API; local answers from the full-text index over stored results
+SEARCH_MODES = ("web", "local")
+
+
+def quota_reason(response):
+    """
+    Find the quota error reason in a search API error response.
+
+    Args:
+        response (requests.Response): Response with an error status
+
+    Returns:
+        str: One of QUOTA_REASONS, or None if the body names none, e.g. for a bad key or a disabled API
+    """
+    try:
+        errors = response.json()["error"].get("errors", [])
+        reasons = [error.get("reason") for error in errors]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+    return next((reason for reason in reasons if reason in QUOTA_REASONS), None)
 
-# Initialize the Gemini enhancer
-gemini = GeminiEnhancer()
+
+class QuotaExceeded(Exception):
+    def __init__(self, results):
+        """
+        The search API refused a request because its quota ran out.
+
+        Args:
+            results (DataFrame): Results from the pages fetched before the quota ran out
+        """
+        super().__init__("Search API quota exhausted")
+        self.results = results
 
 
 def search_api(query, country=None, pages=int(RESULT_COUNT / 10)):
@@ -25,84 +127,416 @@ def search_api(query, country=None, pages=int(RESULT_COUNT / 10)):
 
     Returns:
         DataFrame: Search results
-    """
-    results = []
-    for i in range(0, pages):
-        start = i * 10 + 1
 
+    Raises:
+        QuotaExceeded: If the API answered with a quota error; carries the results fetched so far
+    """
+    def build_url(page):
         # Base URL
         url = SEARCH_URL.format(
             key=SEARCH_KEY,
             cx=SEARCH_ID,
             query=quote_plus(query),
-            start=start
+            start=page * 10 + 1
         )
 
         # Add country restriction if provided
         if country and len(country) == 2:
             url += f"&cr=country{country.upper()}"
+        return url
+
+    # Once a page comes back empty, later pages are past the end of the results
+    last_page = [pages]
+    last_page_lock = threading.Lock()
+    quota_exhausted = threading.Event()
+
+    def past_end(page):
+        return page > last_page[0]
 
+    def end_at(page):
+        with last_page_lock:
+            last_page[0] = min(last_page[0], page)
+
+    def fetch_page(page):
+        # Items of the page, [] past the end of the results, None if the request failed
+        if past_end(page):
+            return []
         try:
-            response = requests.get(url)
+            response = get_with_retry(build_url(page), cancelled=lambda: past_end(page),
+                                      retryable=lambda response: quota_reason(response) is None,
+                                      timeout=SEARCH_API_TIMEOUT)
+            reason = quota_reason(response) if response.status_code != 200 else None
+            if reason is not None or response.status_code == 429:
+                print(f"Search API quota exhausted (HTTP {response.status_code} {reason or 'after retries'}) on page {page + 1}")
+                quota_exhausted.set()
+                # Later pages would run into the same quota
+                end_at(page)
+                return None
+            if response.status_code != 200:
+                print(f"Search API error (HTTP {response.status_code}) on page {page + 1}")
+                return None
             data = response.json()
-
-            # Check if 'items' exists in the response
-            if 'items' in data:
-                results += data['items']
-            else:
-                print(f"No items found in API response for page {i + 1}")
         except Exception as e:
-            print(f"Error in search API call: {e}")
+            # A failed page doesn't mean the results end here; later pages are kept
+            print(f"Error in search API call for page {page + 1}: {e}")
+            return None
+
+        # Check if 'items' exists in the response
+        if 'items' in data:
+            return data['items']
+        print(f"No items found in API response for page {page + 1}")
+        end_at(page)
+        return []
+
+    # Fetch every page at once over the shared keep-alive session
+    pages_items = [None] * pages
+    if pages > 0:
+        with ThreadPoolExecutor(max_workers=pages) as executor:
+            futures = {executor.submit(fetch_page, page): page for page in range(pages)}
+            for future in as_completed(futures):
+                pages_items[futures[future]] = future.result()
+
+    # Merge in page order, skipping failed pages and stopping at the end of the results
+    results = []
+    for items in pages_items:
+        if items is None:
+            continue
+        if not items:
+            break
+        results += items
 
     # If we have results, convert to DataFrame
     if results:
         res_df = pd.DataFrame.from_dict(results)
         res_df["rank"] = list(range(1, res_df.shape[0] + 1))
         res_df = res_df[["link", "rank", "snippet", "title"]]
-        return res_df
     else:
         # Return empty DataFrame with correct columns
-        return pd.DataFrame(columns=["link", "rank", "snippet", "title"])
+        res_df = pd.DataFrame(columns=["link", "rank", "snippet", "title"])
+
+    if quota_exhausted.is_set():
+        raise QuotaExceeded(res_df)
+    return res_df
+
+
+@timed("local_search", count=len)
+def local_results(query, limit=RESULT_COUNT):
+    """
+    Search the full-text index over previously stored results.
+
+    Args:
+        query (str): The search query
+        limit (int): Maximum number of results
+
+    Returns:
+        DataFrame: Results in the same columns as search_api, best BM25 match first
+    """
+    hits = get_storage().text.search(query, limit=limit)
+    hits["rank"] = list(range(1, hits.shape[0] + 1))
+    return hits[["link", "rank", "snippet", "title"]]
+
+
+def merge_local_results(results, query):
+    """
+    Fill up search API results with local full-text hits, ranked after them.
+
+    Args:
+        results (DataFrame): Results from search_api, possibly empty
+        query (str): The search query
+
+    Returns:
+        DataFrame: API results followed by local hits for other links, snippet_source "local"
+    """
+    local = local_results(query)
+    local = local[~local["link"].isin(results["link"])].head(max(0, RESULT_COUNT - len(results))).copy()
+    local["rank"] = list(range(len(results) + 1, len(results) + len(local) + 1))
+    local["snippet_source"] = "local"
+    return pd.concat([results, local], ignore_index=True)
 
 
 def scrape_page(links):
     """
-    Scrape HTML content for each link.
+    Scrape HTML content for each link concurrently.
 
     Args:
         links (list): List of URLs to scrape
 
     Returns:
-        list: HTML content for each link
+        list: HTML content for each link, in the original link order
     """
-    html = []
-    for link in links:
-        try:
-            data = requests.get(link, timeout=5)
-            html.append(data.text)
-        except RequestException:
-            html.append("")
-    return html
+    return get_scraper().scrape(links)
+
+
+COLUMNS = ["query", "rank", "link", "title", "snippet", "html", "created",
+           "api_rank", "semantic_score", "filter_verdict", "snippet_source", "enhanced_model", "enhanced_at"]
 
 
-def search(query, country=None):
+@timed("sqlite_load", count=len)
+def load_stored_results(query_id):
     """
-    Enhanced search function with Gemini integration and country filtering.
+    Load previously stored results for a query ID.
+
+    Args:
+        query_id (str): Identifier from make_query_id
+
+    Returns:
+        DataFrame: Stored results, empty if the query hasn't been seen before
+    """
+    storage = get_storage()
+    # HTML is loaded on demand from the HTML store (storage.page_html, pages_html)
+    stored_results = storage.query_results(query_id)
+    increment("stored_results_hits" if stored_results.shape[0] > 0 else "stored_results_misses")
+    if stored_results.shape[0] > 0:
+        stored_results["created"] = pd.to_datetime(stored_results["created"])
+    return stored_results
+
+
+def find_similar_query(query, country=None, threshold=QUERY_SIMILARITY_THRESHOLD):
+    """
+    Find an earlier, near-duplicate query whose stored results can answer this one.
 
     Args:
         query (str): Original user query
+        country (str, optional): Two-letter country code; only queries for the same country match
+        threshold (float): Minimum similarity of the normalized queries; 0 disables the lookup
+
+    Returns:
+        str: Query ID of the most similar stored query, or None
+    """
+    if threshold <= 0:
+        return None
+    match = get_storage().queries.find_similar(normalize_query(query), country, threshold)
+    increment("near_duplicate_hits" if match else "near_duplicate_misses")
+    if match is None:
+        return None
+    print(f"Reusing results of similar query '{match[0]}' (similarity {match[1]:.2f})")
+    return match[0]
+
+
+def load_results_or_similar(query_id, query, country=None):
+    """
+    Load the stored results for a query ID, falling back to those of a near-duplicate query.
+
+    Borrowed results keep the other query's ID in their query column; see results_borrowed.
+    """
+    stored_results = load_stored_results(query_id)
+    if stored_results.shape[0] == 0:
+        similar_id = find_similar_query(query, country)
+        if similar_id is not None:
+            stored_results = load_stored_results(similar_id)
+    return stored_results
+
+
+def results_borrowed(stored_results, query_id):
+    """Check whether stored results belong to a near-duplicate query rather than query_id."""
+    return stored_results.shape[0] > 0 and bool((stored_results["query"] != query_id).any())
+
+
+@timed("search_api", count=len)
+def api_results(query, expanded_query, query_id, country=None):
+    """
+    Fetch fresh results from the search API, without their pages.
+
+    Args:
+        query (str): Original user query, used if the expanded query finds nothing
+        expanded_query (str): Query sent to the search API first
+        query_id (str): Identifier stored with each result
         country (str, optional): Two-letter country code for location-specific results
 
     Returns:
-        DataFrame: Enhanced and ranked search results
+        DataFrame: Results, empty if nothing was found
+    """
+    try:
+        # Get fresh search results using expanded query and country parameter
+        results = search_api(expanded_query, country=country)
+
+        # If no results found, try with original query
+        if results.empty and expanded_query != query:
+            results = search_api(query, country=country)
+    except QuotaExceeded as e:
+        # Fill in from the results stored for earlier searches
+        increment("api_quota_exhausted")
+        results = merge_local_results(e.results, query)
+
+    # If still no results, return empty DataFrame
+    if results.empty:
+        return pd.DataFrame(columns=COLUMNS)
+
+    # Add query and timestamp - use the query_id to store country information
+    results["query"] = query_id
+    results["created"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    # Keep the API rank so the results can be re-scored later
+    results["api_rank"] = results["rank"]
+    if "snippet_source" in results:
+        results["snippet_source"] = results["snippet_source"].fillna("api")
+    else:
+        results["snippet_source"] = "api"
+    return results
+
+
+@timed("scrape_page", count=len)
+def scrape_results(results):
     """
-    columns = ["query", "rank", "link", "title", "snippet", "html", "created"]
-    storage = DBStorage()
+    Scrape the pages of API results, dropping results whose page couldn't be loaded.
+
+    Pages stored with an ETag or Last-Modified are requested conditionally;
+    unchanged ones keep their stored HTML instead of being downloaded again.
+    """
+    if results.empty:
+        return results
+    results = results.copy()
+    links = list(results["link"])
+    html_store = get_storage().html
+    pages = get_scraper().scrape_pages(links, html_store.validators(links))
+    unchanged = html_store.get_many(link for link, page in zip(links, pages) if page.not_modified)
+    results["html"] = [unchanged.get(link, "") if page.not_modified else page.html
+                       for link, page in zip(links, pages)]
+    results["etag"] = [page.etag for page in pages]
+    results["last_modified"] = [page.last_modified for page in pages]
+    return results[results["html"].str.len() > 0].copy()
+
+
+def fetch_results(query, expanded_query, query_id, country=None):
+    """
+    Fetch fresh results from the search API and scrape their pages.
+
+    Args:
+        query (str): Original user query, used if the expanded query finds nothing
+        expanded_query (str): Query sent to the search API first
+        query_id (str): Identifier stored with each result
+        country (str, optional): Two-letter country code for location-specific results
+
+    Returns:
+        DataFrame: Results with HTML, empty if nothing was found
+    """
+    return scrape_results(api_results(query, expanded_query, query_id, country=country))
+
+
+def query_ttl(query):
+    """Seconds the stored results of a query stay fresh; shorter for time-sensitive queries."""
+    # Query words keep their symbols; trailing punctuation doesn't matter here
+    tokens = {token.strip(".,;:!?'\"()") for token in query_tokens(query)}
+    if tokens & TIME_SENSITIVE_WORDS or str(datetime.utcnow().year) in tokens:
+        return min(RESULTS_TTL, RESULTS_FRESH_TTL)
+    return RESULTS_TTL
+
+
+def results_freshness(stored_results, query):
+    """
+    Classify stored results by age.
+
+    Args:
+        stored_results (DataFrame): Results loaded with load_stored_results
+        query (str): Original user query, which decides the TTL
+
+    Returns:
+        str: missing if there are none, fresh within the query's TTL, stale within
+             RESULTS_MAX_STALE after that, expired otherwise
+    """
+    if stored_results.shape[0] == 0:
+        return "missing"
+    ttl = query_ttl(query)
+    if ttl <= 0:
+        return "fresh"
+    age = (datetime.utcnow() - stored_results["created"].min()).total_seconds()
+    if age != age:
+        # No usable timestamp: serve the results but refresh them
+        return "stale"
+    if age <= ttl:
+        return "fresh"
+    return "stale" if age <= ttl + RESULTS_MAX_STALE else "expired"
+
+
+def enhancements_current(stored_results, model_name):
+    """
+    Check whether stored Gemini enhancements can be reused.
+
+    Args:
+        stored_results (DataFrame): Results loaded with load_stored_results
+        model_name (str): Model currently used for enhancements
+
+    Returns:
+        bool: True if every result was enhanced by model_name within ENHANCEMENT_TTL
+    """
+    if not (stored_results["enhanced_model"] == model_name).all():
+        return False
+    enhanced_at = pd.to_datetime(stored_results["enhanced_at"], errors="coerce")
+    cutoff = datetime.utcnow() - timedelta(seconds=ENHANCEMENT_TTL)
+    return bool((enhanced_at >= cutoff).all())
+
+
+def reset_ranks(stored_results):
+    """Restore the search API rank before stored results are scored again."""
+    results = stored_results.copy()
+    results["rank"] = results["api_rank"].fillna(results["rank"])
+    return results
+
+
+def mark_enhanced(results, model_name):
+    """Record which model enhanced the results, and when."""
+    results = results.copy()
+    results["enhanced_model"] = model_name
+    results["enhanced_at"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    return results
+
+
+@timed("sqlite_store")
+def update_stored_enhancements(results):
+    """Save re-computed enhancements for stored results."""
+    storage = get_storage()
+    storage.update_enhancements(results)
+
+
+@timed("sqlite_store", count=len)
+def store_results(results):
+    """Select the stored columns and save the results, replacing those stored for the query before."""
+    storage = get_storage()
+    # The page validators are stored with the HTML, for conditional re-scraping
+    storage.insert_results(results.reindex(columns=COLUMNS + ["etag", "last_modified"]), replace=True)
+    return results.reindex(columns=COLUMNS)
+
+
+def search_local(query, country=None):
+    """
+    Answer a query from the full-text index over stored results, without calling any API.
+
+    Args:
+        query (str): Original user query
+        country (str, optional): Recorded in the query column; the index isn't split by country
+
+    Returns:
+        DataFrame: Stored results matching the query, best match first
+    """
+    results = local_results(query)
+    results["query"] = make_query_id(query, country)
+    results["snippet_source"] = "local"
+    return results.reindex(columns=COLUMNS)
+
+
+def fetch_stream(query, country=None):
+    """
+    Run the search pipeline against the search API, yielding results as each stage finishes.
+
+    The raw search API results come first, before any page is scraped,
+    followed by the semantically ranked results and finally the filtered
+    results with improved snippets, which are stored.
+
+    Args:
+        query (str): Original user query
+        country (str, optional): Two-letter country code for location-specific results
+
+    Yields:
+        DataFrame: Results so far, sorted by rank. The last one yielded is final.
+    """
+    gemini_enabled = bool(os.getenv("GEMINI_API_KEY"))
+    gemini = get_gemini() if gemini_enabled else None
+    query_id = make_query_id(query, country)
 
     # Step 1: Query Expansion with Gemini
     try:
         # Check if Gemini API key is available
-        if os.getenv("GEMINI_API_KEY"):
+        if gemini_enabled:
             expanded_query = gemini.expand_query(query)
             print(f"Original query: {query}")
             print(f"Expanded query: {expanded_query}")
@@ -113,51 +547,24 @@ def search(query, country=None):
         print(f"Error in query expansion: {e}")
         expanded_query = query  # Fallback to original query
 
-    # Create a unique identifier for this query + country combination
-    query_id = query
-    if country:
-        query_id = f"{query}__country_{country}"
-
-    # Check for stored results with this query ID
-    stored_results = storage.query_results(query_id)
-    if stored_results.shape[0] > 0:
-        stored_results["created"] = pd.to_datetime(stored_results["created"])
-
-        # For stored results, we still enhance with semantic ranking if API key is available
-        if os.getenv("GEMINI_API_KEY"):
-            try:
-                stored_results = gemini.rank_results_semantically(query, stored_results)
-                stored_results = gemini.filter_content(stored_results)
-                stored_results = stored_results.sort_values("rank", ascending=True)
-            except Exception as e:
-                print(f"Error enhancing stored results: {e}")
-
-        return stored_results[columns]
-
-    # Get fresh search results using expanded query and country parameter
-    results = search_api(expanded_query, country=country)
-
-    # If no results found, try with original query
-    if results.empty and expanded_query != query:
-        results = search_api(query, country=country)
-
-    # If still no results, return empty DataFrame
+    # Steps 2-3: Search API results, shown before any page is scraped
+    results = api_results(query, expanded_query, query_id, country=country)
+    yield results.reindex(columns=COLUMNS)
     if results.empty:
-        return pd.DataFrame(columns=columns)
-
-    # Get HTML content
-    results["html"] = scrape_page(results["link"])
-    results = results[results["html"].str.len() > 0].copy()
+        return
 
-    # Add query and timestamp - use the query_id to store country information
-    results["query"] = query_id
-    results["created"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    # Step 4: Get HTML content
+    results = scrape_results(results)
+    if results.empty:
+        yield results.reindex(columns=COLUMNS)
+        return
 
     # Step 5: Semantic Ranking + Filtering + Summarization with Gemini (if API key is available)
-    if os.getenv("GEMINI_API_KEY"):
+    if gemini_enabled:
         try:
             # Enhanced semantic ranking
-            results = gemini.rank_results_semantically(query, results)
+            results = gemini.rank_results(query, results)
+            yield results.sort_values("rank", ascending=True).reindex(columns=COLUMNS)
 
             # Content filtering
             results = gemini.filter_content(results)
@@ -167,11 +574,188 @@ def search(query, country=None):
 
             # Sort by the enhanced rank
             results = results.sort_values("rank", ascending=True)
+            results = mark_enhanced(results, gemini.enhanced_by)
         except Exception as e:
             print(f"Error in semantic enhancement: {e}")
 
     # Select columns and store results
-    results = results[columns]
-    results.apply(lambda x: storage.insert_row(x), axis=1)
+    yield store_results(results)
+
+
+@timed("refresh", count=len)
+def refresh_results(query, country=None):
+    """
+    Refetch and store the results of a query; run in the background for stale results.
+
+    Args:
+        query (str): Original user query
+        country (str, optional): Two-letter country code for location-specific results
+
+    Returns:
+        DataFrame: Refreshed results, empty if the search API found nothing
+    """
+    results = None
+    for results in fetch_stream(query, country=country):
+        pass
+    return results
+
+
+def schedule_refresh(query, country=None):
+    """Refresh a query's stored results in the background, once even if asked for repeatedly."""
+    increment("stale_results_served")
+    return get_revalidator().submit(make_query_id(query, country), refresh_results, query, country)
+
+
+def search_stream(query, country=None, mode="web"):
+    """
+    Run the search pipeline, yielding results as each stage finishes.
+
+    For a new query the raw search API results come first, before any page
+    is scraped, followed by the semantically ranked results and finally the
+    filtered results with improved snippets. Stored results are yielded
+    straight away, and again if their enhancements had to be recomputed.
+    Stale stored results are yielded as they are and refreshed in the
+    background; expired ones are refetched first (see results_freshness).
+
+    Args:
+        query (str): Original user query
+        country (str, optional): Two-letter country code for location-specific results
+        mode (str): web, or local to answer from stored results only (see search_local)
+
+    Yields:
+        DataFrame: Results so far, sorted by rank. The last one yielded is final
+                   and is what search() returns.
+    """
+    if mode == "local":
+        yield search_local(query, country=country)
+        return
+
+    gemini_enabled = bool(os.getenv("GEMINI_API_KEY"))
+    query_id = make_query_id(query, country)
+
+    # Check for stored results with this query ID
+    stored_results = load_results_or_similar(query_id, query, country)
+    freshness = results_freshness(stored_results, query)
+    if freshness == "stale":
+        # Schedule first: the caller may stop after the first results. The refresh re-enhances them as well.
+        schedule_refresh(query, country)
+        yield stored_results.sort_values("rank", ascending=True).reindex(columns=COLUMNS)
+        return
+
+    if freshness == "fresh":
+        yield stored_results.sort_values("rank", ascending=True).reindex(columns=COLUMNS)
+
+        # Reuse stored enhancements unless they expired or came from another model. Borrowed
+        # results are served as they are: scores for this query would overwrite the other query's.
+        gemini = get_gemini() if gemini_enabled else None
+        if (gemini_enabled and not results_borrowed(stored_results, query_id)
+                and not enhancements_current(stored_results, gemini.enhanced_by)):
+            try:
+                stored_results = gemini.rank_results(query, reset_ranks(stored_results))
+                stored_results = gemini.filter_content(stored_results)
+                stored_results = mark_enhanced(stored_results, gemini.enhanced_by)
+                update_stored_enhancements(stored_results)
+                yield stored_results.sort_values("rank", ascending=True).reindex(columns=COLUMNS)
+            except Exception as e:
+                print(f"Error enhancing stored results: {e}")
+        return
+
+    if freshness == "expired":
+        increment("expired_results")
+    results = None
+    for results in fetch_stream(query, country=country):
+        yield results
+    # Expired results beat none at all, e.g. when the search API is down
+    if results is not None and results.empty and stored_results.shape[0] > 0:
+        yield stored_results.sort_values("rank", ascending=True).reindex(columns=COLUMNS)
+
+
+@timed("search", count=len)
+def search(query, country=None, mode="web"):
+    """
+    Enhanced search function with Gemini integration and country filtering.
+
+    Args:
+        query (str): Original user query
+        country (str, optional): Two-letter country code for location-specific results
+        mode (str): web, or local to answer from stored results only (see search_local)
+
+    Returns:
+        DataFrame: Enhanced and ranked search results
+    """
+    results = None
+    for results in search_stream(query, country=country, mode=mode):
+        pass
+    return results
+
+
+@timed("search", count=len)
+async def search_async(query, country=None, mode="web"):
+    """
+    Asynchronous version of search().
+
+    Gemini requests go through AsyncGeminiEnhancer so independent per-document
+    calls run concurrently; the search API, scraping and sqlite work run in
+    worker threads so the event loop is never blocked. Stale stored results
+    are returned straight away and refreshed in the background.
+
+    Args:
+        query (str): Original user query
+        country (str, optional): Two-letter country code for location-specific results
+        mode (str): web, or local to answer from stored results only (see search_local)
+
+    Returns:
+        DataFrame: Enhanced and ranked search results
+    """
+    if mode == "local":
+        return await asyncio.to_thread(search_local, query, country)
+
+    gemini_enabled = bool(os.getenv("GEMINI_API_KEY"))
+    async_gemini = get_async_gemini() if gemini_enabled else None
+    query_id = make_query_id(query, country)
+
+    stored_results = await asyncio.to_thread(load_results_or_similar, query_id, query, country)
+    freshness = results_freshness(stored_results, query)
+    if freshness == "stale":
+        schedule_refresh(query, country)
+        return stored_results.sort_values("rank", ascending=True).reindex(columns=COLUMNS)
+
+    if freshness == "fresh":
+        # Reuse stored enhancements unless they expired or came from another model. Borrowed
+        # results are served as they are: scores for this query would overwrite the other query's.
+        if (gemini_enabled and not results_borrowed(stored_results, query_id)
+                and not enhancements_current(stored_results, async_gemini.enhanced_by)):
+            try:
+                stored_results = await async_gemini.rank_results(query, reset_ranks(stored_results))
+                stored_results = await async_gemini.filter_content(stored_results)
+                stored_results = mark_enhanced(stored_results, async_gemini.enhanced_by)
+                await asyncio.to_thread(update_stored_enhancements, stored_results)
+            except Exception as e:
+                print(f"Error enhancing stored results: {e}")
+
+        return stored_results.sort_values("rank", ascending=True).reindex(columns=COLUMNS)
+
+    expanded_query = query
+    if gemini_enabled:
+        try:
+            expanded_query = await async_gemini.expand_query(query)
+        except Exception as e:
+            print(f"Error in query expansion: {e}")
+
+    if freshness == "expired":
+        increment("expired_results")
+    results = await asyncio.to_thread(fetch_results, query, expanded_query, query_id, country)
+    if results.empty:
+        # Expired results beat none at all, e.g. when the search API is down
+        if stored_results.shape[0] > 0:
+            return stored_results.sort_values("rank", ascending=True).reindex(columns=COLUMNS)
+        return results.reindex(columns=COLUMNS)
+
+    if gemini_enabled:
+        try:
+            results = await async_gemini.enhance(query, results)
+            results = mark_enhanced(results, async_gemini.enhanced_by)
+        except Exception as e:
+            print(f"Error in semantic enhancement: {e}")
 
-    return results
\ No newline at end of file
+    return await asyncio.to_thread(store_results, results)
@@ -1,11 +1,634 @@
+import hashlib
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+import numpy as np
 import pandas as pd
+from query_keys import jaccard, lsh_buckets, make_query_id, minhash, shingles, split_query_id
 
+# zstd compresses HTML better and faster than zlib, but is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-class DBStorage():
+# SQLite database shared by the results, HTML and LLM response tables
+DB_PATH = os.getenv("LINKS_DB", "links.db")
+
+# Bump when the results schema changes; setup_tables migrates older files
+SCHEMA_VERSION = 7
+
+# Columns added after the original schema, with their types
+ENHANCEMENT_COLUMNS = {
+    "api_rank": "INTEGER",          # Rank as returned by the search API
+    "semantic_score": "REAL",       # Gemini relevance score, 0.0 to 10.0
+    "filter_verdict": "TEXT",       # FILTER or KEEP
+    "snippet_source": "TEXT",       # api or gemini
+    "enhanced_model": "TEXT",       # Model that produced the enhancements
+    "enhanced_at": "DATETIME",      # When the enhancements were computed
+}
+
+
+def to_rows(df, columns):
+    """Convert DataFrame columns to a list of rows of plain Python values, with None for missing values."""
+    values = df[columns].astype(object)
+    return values.where(pd.notna(values), None).values.tolist()
+
+
+# Columns written by insert_results; relevance is only set through user feedback
+RESULT_COLUMNS = ["query", "rank", "link", "title", "snippet", "html", "created"] + list(ENHANCEMENT_COLUMNS)
+
+# Connection pragmas applied when WAL mode is on
+TUNED_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",      # Readers don't block the writer and vice versa
+    "PRAGMA synchronous=NORMAL",    # WAL is still crash-safe, with fewer fsyncs
+    "PRAGMA busy_timeout=5000",     # Wait for a lock instead of failing straight away
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",     # 20MB page cache
+]
+
+
+class ConnectionPool():
+    def __init__(self, path=DB_PATH, wal=True):
+        """
+        Per-thread SQLite connections to one database file.
+
+        sqlite3 connections can't be shared between threads, so every thread
+        gets its own connection on first use. Writes from all threads are
+        serialized through write_lock so they never race for the database
+        lock; with WAL on, reads run alongside them.
+
+        Args:
+            path (str): SQLite database file
+            wal (bool): Use WAL journaling and the tuned pragmas in TUNED_PRAGMAS
+        """
+        self.path = path
+        self.wal = wal
+        self.write_lock = threading.RLock()
+        self._local = threading.local()
+
+    def connection(self):
+        """Return the calling thread's connection, opening it if needed."""
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30)
+            if self.wal:
+                for pragma in TUNED_PRAGMAS:
+                    con.execute(pragma)
+            self._local.con = con
+        return con
+
+
+_pools = {}
+_storages = {}
+_registry_lock = threading.Lock()
+
+
+def get_pool(path=DB_PATH, wal=True):
+    """Return the process-wide connection pool for a database file."""
+    with _registry_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path, wal=wal)
+        return _pools[path]
+
+
+def get_storage(path=DB_PATH):
+    """
+    Return the process-wide DBStorage for a database file.
+
+    The schema is set up once, when the storage is first requested, and the
+    same handle can be shared by every thread and Streamlit session.
+    """
+    with _registry_lock:
+        storage = _storages.get(path)
+    if storage is None:
+        storage = DBStorage(path)
+        with _registry_lock:
+            storage = _storages.setdefault(path, storage)
+    return storage
+
+
+class BackgroundWriter():
     def __init__(self):
-        self.con = sqlite3.connect("links.db")
-        self.setup_tables()
+        """
+        Runs write tasks one at a time on a daemon thread, so callers never wait on the database.
+        """
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            task, args = self._queue.get()
+            try:
+                task(*args)
+            except Exception as e:
+                print(f"Error in background write: {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, task, *args):
+        """Queue task(*args) to run on the writer thread."""
+        self._queue.put((task, args))
+
+    def flush(self):
+        """Wait until every queued task has run."""
+        self._queue.join()
+
+
+_writer = None
+
+
+def get_writer():
+    """Return the process-wide BackgroundWriter, starting it on first use."""
+    global _writer
+    with _registry_lock:
+        if _writer is None:
+            _writer = BackgroundWriter()
+        return _writer
+
+
+class HtmlStore():
+    def __init__(self, pool=None, path=DB_PATH):
+        """
+        Content-addressed store for page HTML.
+
+        Each distinct page body is compressed and stored once under its
+        SHA-256 hash; the pages table maps each link to the hash of its
+        latest content.
+
+        Args:
+            pool (ConnectionPool, optional): Pool to share, e.g. with DBStorage,
+                which then sets up the tables
+            path (str): SQLite database file, used when no pool is given
+        """
+        if pool is None:
+            pool = get_pool(path)
+            with pool.write_lock:
+                con = pool.connection()
+                self.setup_tables(con.cursor())
+                con.commit()
+        self.pool = pool
+
+    @property
+    def con(self):
+        return self.pool.connection()
+
+    @staticmethod
+    def setup_tables(cur):
+        cur.execute(r"""
+            CREATE TABLE IF NOT EXISTS html_blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT,
+                data BLOB
+            );
+        """)
+        cur.execute(r"""
+            CREATE TABLE IF NOT EXISTS pages (
+                link TEXT PRIMARY KEY,
+                hash TEXT,
+                fetched DATETIME,
+                etag TEXT,
+                last_modified TEXT
+            );
+        """)
+        # Finds the links still pointing at a blob when a page's content changes
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pages_hash ON pages (hash);")
+
+    @staticmethod
+    def compress(data):
+        if zstandard is not None:
+            return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+        return "zlib", zlib.compress(data, 6)
+
+    @staticmethod
+    def decompress(codec, data):
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("HTML was stored with zstd, but the zstandard package is not installed")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def put_many(self, pages, commit=True):
+        """
+        Store the HTML for many links.
+
+        Content that a link pointed at before is deleted once no link points
+        at it any more, so the store doesn't grow as pages change.
+
+        Args:
+            pages (iterable): (link, html) pairs, or (link, html, etag, last_modified)
+                tuples to keep the validators for conditional re-scraping; empty HTML is skipped
+            commit (bool): Commit when done. Pass False to write inside a
+                transaction the caller already has open on a shared connection.
+        """
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        blobs = {}
+        links = []
+        for link, html, *validators in pages:
+            if not isinstance(html, str) or not html:
+                continue
+            # Validators missing from a DataFrame come through as NaN
+            etag, last_modified = [value if isinstance(value, str) else None for value in (validators + [None, None])[:2]]
+            data = html.encode("utf-8")
+            content_hash = hashlib.sha256(data).hexdigest()
+            blobs[content_hash] = data
+            links.append([link, content_hash, now, etag, last_modified])
+        if not links:
+            return
+
+        with self.pool.write_lock:
+            cur = self.con.cursor()
+            # Only compress content that isn't stored yet
+            hashes = list(blobs)
+            stored = set()
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                cur.execute(f"SELECT hash FROM html_blobs WHERE hash IN ({','.join('?' * len(chunk))})", chunk)
+                stored.update(row[0] for row in cur.fetchall())
+            new_blobs = [[h, *self.compress(data)] for h, data in blobs.items() if h not in stored]
+
+            # Content the links pointed at until now
+            names = [row[0] for row in links]
+            previous = set()
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                cur.execute(f"SELECT hash FROM pages WHERE link IN ({','.join('?' * len(chunk))})", chunk)
+                previous.update(row[0] for row in cur.fetchall())
+
+            cur.executemany("INSERT OR IGNORE INTO html_blobs(hash, codec, data) VALUES(?,?,?)", new_blobs)
+            cur.executemany("INSERT INTO pages(link, hash, fetched, etag, last_modified) VALUES(?,?,?,?,?) "
+                            "ON CONFLICT(link) DO UPDATE SET hash=excluded.hash, fetched=excluded.fetched, "
+                            "etag=excluded.etag, last_modified=excluded.last_modified", links)
+
+            replaced = [h for h in previous if h not in blobs]
+            for i in range(0, len(replaced), 500):
+                chunk = replaced[i:i + 500]
+                cur.execute(f"DELETE FROM html_blobs WHERE hash IN ({','.join('?' * len(chunk))}) "
+                            "AND NOT EXISTS (SELECT 1 FROM pages WHERE pages.hash = html_blobs.hash)", chunk)
+            if commit:
+                self.con.commit()
+            cur.close()
+
+    def put(self, link, html):
+        """Store the HTML for one link."""
+        self.put_many([(link, html)])
+
+    def get_many(self, links):
+        """
+        Load the HTML for many links.
+
+        Args:
+            links (iterable): Links to load
+
+        Returns:
+            dict: HTML for each link that has stored content
+        """
+        links = list(dict.fromkeys(links))
+        html = {}
+        cur = self.con.cursor()
+        for i in range(0, len(links), 500):
+            chunk = links[i:i + 500]
+            cur.execute("SELECT p.link, b.codec, b.data FROM pages p JOIN html_blobs b ON b.hash = p.hash "
+                        f"WHERE p.link IN ({','.join('?' * len(chunk))})", chunk)
+            for link, codec, data in cur.fetchall():
+                html[link] = self.decompress(codec, data).decode("utf-8")
+        cur.close()
+        return html
+
+    def validators(self, links):
+        """
+        Load the cache validators of stored pages.
+
+        Args:
+            links (iterable): Links to look up
+
+        Returns:
+            dict: (etag, last_modified) for each link stored with at least one of them
+        """
+        links = list(dict.fromkeys(links))
+        validators = {}
+        cur = self.con.cursor()
+        for i in range(0, len(links), 500):
+            chunk = links[i:i + 500]
+            cur.execute("SELECT link, etag, last_modified FROM pages "
+                        f"WHERE link IN ({','.join('?' * len(chunk))}) "
+                        "AND (etag IS NOT NULL OR last_modified IS NOT NULL)", chunk)
+            for link, etag, last_modified in cur.fetchall():
+                validators[link] = (etag, last_modified)
+        cur.close()
+        return validators
+
+    def get(self, link):
+        """Load the HTML for one link, or an empty string if none is stored."""
+        return self.get_many([link]).get(link, "")
+
+    def prune(self):
+        """Delete content no longer referenced by any link, e.g. left behind by older versions."""
+        with self.pool.write_lock:
+            self.con.execute("DELETE FROM html_blobs WHERE NOT EXISTS "
+                             "(SELECT 1 FROM pages WHERE pages.hash = html_blobs.hash)")
+            self.con.commit()
+
+
+def fts5_available():
+    """Check whether this SQLite build includes the FTS5 full-text extension."""
+    try:
+        sqlite3.connect(":memory:").execute("CREATE VIRTUAL TABLE probe USING fts5(text)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+# Full-text search needs FTS5; without it the local index stays empty
+FTS5 = fts5_available()
+
+# Page text kept in the full-text index for each link
+FTS_BODY_CHARS = 20000
+
+# BM25 column weights for title, snippet and page text
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+
+
+class TextIndex():
+    def __init__(self, pool=None, path=DB_PATH):
+        """
+        Full-text index over stored results, ranked with BM25.
+
+        Holds one document per link with its latest title, snippet and page
+        text, updated as results are inserted. Requires SQLite's FTS5
+        extension; without it nothing is indexed and search() finds nothing.
+
+        Args:
+            pool (ConnectionPool, optional): Pool to share, e.g. with DBStorage,
+                which then sets up the tables
+            path (str): SQLite database file, used when no pool is given
+        """
+        if pool is None:
+            pool = get_pool(path)
+            with pool.write_lock:
+                con = pool.connection()
+                self.setup_tables(con.cursor())
+                con.commit()
+        self.pool = pool
+
+    @property
+    def con(self):
+        return self.pool.connection()
+
+    @staticmethod
+    def setup_tables(cur):
+        if not FTS5:
+            return
+        cur.execute(r"""
+            CREATE TABLE IF NOT EXISTS search_docs (
+                id INTEGER PRIMARY KEY,
+                link TEXT UNIQUE NOT NULL,
+                indexed DATETIME
+            );
+        """)
+        cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts "
+                    "USING fts5(title, snippet, body, tokenize='porter unicode61')")
+
+    @staticmethod
+    def page_text(html):
+        if not isinstance(html, str) or not html:
+            return None
+        # Imported here; parsing is only needed when pages are indexed
+        from page_parser import parse_page
+        return " ".join(parse_page(html).text.split())[:FTS_BODY_CHARS]
+
+    @classmethod
+    def documents(cls, rows):
+        """
+        Turn (link, title, snippet, html) rows into documents for add_many.
+
+        Parsing the pages is the slow part of indexing, so do it before
+        taking the write lock.
+
+        Args:
+            rows (iterable): (link, title, snippet, html) tuples
+
+        Returns:
+            list: (link, title, snippet, body) tuples, body None without HTML
+        """
+        if not FTS5:
+            return []
+        return [(link, title, snippet, cls.page_text(html)) for link, title, snippet, html in rows]
+
+    def add_many(self, docs, commit=True):
+        """
+        Index or re-index many links.
+
+        Args:
+            docs (iterable): (link, title, snippet, body) tuples from documents(). Without
+                a body, a link keeps the page text it was indexed with before.
+            commit (bool): Commit when done. Pass False to write inside a
+                transaction the caller already has open on a shared connection.
+        """
+        if not FTS5:
+            return
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        with self.pool.write_lock:
+            cur = self.con.cursor()
+            for link, title, snippet, body in docs:
+                row = cur.execute("SELECT id FROM search_docs WHERE link=?", [link]).fetchone()
+                if row is None:
+                    cur.execute("INSERT INTO search_docs(link, indexed) VALUES(?,?)", [link, now])
+                    cur.execute("INSERT INTO search_fts(rowid, title, snippet, body) VALUES(?,?,?,?)",
+                                [cur.lastrowid, title, snippet, body or ""])
+                    continue
+                cur.execute("UPDATE search_docs SET indexed=? WHERE id=?", [now, row[0]])
+                if body is None:
+                    cur.execute("UPDATE search_fts SET title=?, snippet=? WHERE rowid=?", [title, snippet, row[0]])
+                else:
+                    cur.execute("UPDATE search_fts SET title=?, snippet=?, body=? WHERE rowid=?",
+                                [title, snippet, body, row[0]])
+            if commit:
+                self.con.commit()
+            cur.close()
+
+    def search(self, query, limit=30):
+        """
+        Find indexed links matching any word of a query, best BM25 match first.
+
+        Args:
+            query (str): Free-text query; FTS5 query syntax is not interpreted
+            limit (int): Maximum number of results
+
+        Returns:
+            DataFrame: link, title, snippet and score (BM25, lower is better)
+        """
+        columns = ["link", "title", "snippet", "score"]
+        # Quote every word so user input can't form FTS5 operators
+        terms = dict.fromkeys(re.findall(r"\w+", query.lower()))
+        if not FTS5 or not terms:
+            return pd.DataFrame(columns=columns)
+        match = " OR ".join(f'"{term}"' for term in terms)
+        weights = ", ".join(str(weight) for weight in FTS_WEIGHTS)
+        return pd.read_sql(
+            f"SELECT d.link, search_fts.title, search_fts.snippet, bm25(search_fts, {weights}) AS score "
+            "FROM search_fts JOIN search_docs d ON d.id = search_fts.rowid "
+            "WHERE search_fts MATCH ? ORDER BY score LIMIT ?",
+            self.con, params=[match, limit])
+
+
+class QueryIndex():
+    def __init__(self, pool=None, path=DB_PATH):
+        """
+        Index of the normalized keys of stored queries, for near-duplicate lookups.
+
+        Keys are bucketed with MinHash locality-sensitive hashing, so similar
+        queries are found without comparing against every stored query.
+
+        Args:
+            pool (ConnectionPool, optional): Pool to share, e.g. with DBStorage,
+                which then sets up the tables
+            path (str): SQLite database file, used when no pool is given
+        """
+        if pool is None:
+            pool = get_pool(path)
+            with pool.write_lock:
+                con = pool.connection()
+                self.setup_tables(con.cursor())
+                con.commit()
+        self.pool = pool
+
+    @property
+    def con(self):
+        return self.pool.connection()
+
+    @staticmethod
+    def setup_tables(cur):
+        cur.execute(r"""
+            CREATE TABLE IF NOT EXISTS query_keys (
+                query_id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                country TEXT
+            );
+        """)
+        cur.execute(r"""
+            CREATE TABLE IF NOT EXISTS query_buckets (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                query_id TEXT NOT NULL,
+                PRIMARY KEY (band, bucket, query_id)
+            );
+        """)
+
+    def add_many(self, query_ids, commit=True):
+        """
+        Register stored queries; already registered ones are skipped.
+
+        Args:
+            query_ids (iterable): Identifiers from make_query_id
+            commit (bool): Commit when done. Pass False to write inside a
+                transaction the caller already has open on a shared connection.
+        """
+        with self.pool.write_lock:
+            cur = self.con.cursor()
+            for query_id in dict.fromkeys(query_ids):
+                if cur.execute("SELECT 1 FROM query_keys WHERE query_id=?", [query_id]).fetchone():
+                    continue
+                key, country = split_query_id(query_id)
+                cur.execute("INSERT INTO query_keys(query_id, key, country) VALUES(?,?,?)", [query_id, key, country])
+                cur.executemany("INSERT OR IGNORE INTO query_buckets(band, bucket, query_id) VALUES(?,?,?)",
+                                [[band, bucket, query_id] for band, bucket in lsh_buckets(minhash(shingles(key)))])
+            if commit:
+                self.con.commit()
+            cur.close()
+
+    def find_similar(self, key, country, threshold):
+        """
+        Find the stored query most similar to a normalized key.
+
+        Args:
+            key (str): Normalized query, see query_keys.normalize_query
+            country (str): Country the query must have been stored for, or None for global
+            threshold (float): Minimum Jaccard similarity of the keys' character shingles
+
+        Returns:
+            tuple: (query_id, similarity) of the best match, or None
+        """
+        buckets = lsh_buckets(minhash(shingles(key)))
+        condition = " OR ".join("(b.band=? AND b.bucket=?)" for _ in buckets)
+        params = [value for bucket in buckets for value in bucket]
+        candidates = self.con.execute(
+            f"SELECT DISTINCT k.query_id, k.key FROM query_buckets b JOIN query_keys k ON k.query_id = b.query_id "
+            f"WHERE ({condition}) AND k.country IS ?", params + [country]).fetchall()
+
+        target = shingles(key)
+        best = None
+        for query_id, candidate_key in candidates:
+            similarity = jaccard(target, shingles(candidate_key))
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (query_id, similarity)
+        return best
+
+
+def page_html(row):
+    """
+    Return a result's HTML, loading it from the HTML store if the row doesn't carry it.
+
+    Args:
+        row (Series): Search result with a 'link' and optionally 'html'
+
+    Returns:
+        str: Page HTML, or an empty string if none is available
+    """
+    html = row.get("html")
+    if isinstance(html, str) and html:
+        return html
+    return get_storage().html.get(row["link"])
+
+
+def pages_html(results):
+    """
+    Return the HTML of many results, loading what the rows don't carry with one HTML store query.
+
+    Args:
+        results (DataFrame): Search results with a 'link' and optionally 'html'
+
+    Returns:
+        list: Page HTML for each row in order, empty strings where none is available
+    """
+    links = list(results["link"])
+    html = list(results["html"]) if "html" in results else [None] * len(links)
+    html = [page if isinstance(page, str) and page else None for page in html]
+    missing = [link for link, page in zip(links, html) if page is None]
+    stored = get_storage().html.get_many(missing) if missing else {}
+    return [page if page is not None else stored.get(link, "") for link, page in zip(links, html)]
+
+
+class DBStorage():
+    def __init__(self, path=DB_PATH, wal=True):
+        """
+        SQLite storage for search results.
+
+        Connections come from the process-wide pool for path, so instances are
+        cheap and safe to use from any thread. Prefer get_storage(), which also
+        runs the schema setup only once per process.
+
+        Args:
+            path (str): SQLite database file
+            wal (bool): Use WAL journaling and the tuned pragmas in TUNED_PRAGMAS
+        """
+        self.pool = get_pool(path, wal=wal)
+        self.html = HtmlStore(self.pool)
+        self.text = TextIndex(self.pool)
+        self.queries = QueryIndex(self.pool)
+        self._vacuum = False
+        with self.pool.write_lock:
+            self.setup_tables()
+
+    @property
+    def con(self):
+        return self.pool.connection()
 
     def setup_tables(self):
         cur = self.con.cursor()  # Changed from self.con.execute() to self.con.cursor()
@@ -20,29 +643,402 @@ class DBStorage():
                 html TEXT,
                 created DATETIME,
                 relevance INTEGER,
+                api_rank INTEGER,
+                semantic_score REAL,
+                filter_verdict TEXT,
+                snippet_source TEXT,
+                enhanced_model TEXT,
+                enhanced_at DATETIME,
                 UNIQUE (query, link)
             );
         """
         cur.execute(results_table)
+        HtmlStore.setup_tables(cur)
+        TextIndex.setup_tables(cur)
+        QueryIndex.setup_tables(cur)
+        self.migrate(cur)
+        # Serves query_results in rank order without scanning or sorting
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_results_query_rank ON results (query, rank);")
         self.con.commit()
+        self.columns = [row[1] for row in cur.execute("PRAGMA table_info(results)")]
         cur.close()
 
-    def query_results(self, query):
-        df = pd.read_sql(f"select * from results where query='{query}' order by rank asc;", self.con)
+        # Give the space freed by a migration back to the filesystem
+        if self._vacuum:
+            self.con.execute("VACUUM")
+            self._vacuum = False
+
+    def migrate(self, cur):
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        # Version 2: enhancement columns on results
+        existing = {row[1] for row in cur.execute("PRAGMA table_info(results)")}
+        for column, column_type in ENHANCEMENT_COLUMNS.items():
+            if column not in existing:
+                cur.execute(f"ALTER TABLE results ADD COLUMN {column} {column_type}")
+
+        # Version 3: move inline HTML into the HTML store
+        if version < 3:
+            while True:
+                rows = cur.execute("SELECT id, link, html FROM results WHERE html IS NOT NULL LIMIT 500").fetchall()
+                if not rows:
+                    break
+                self.html.put_many([(link, html) for _, link, html in rows], commit=False)
+                cur.executemany("UPDATE results SET html=NULL WHERE id=?", [[row_id] for row_id, _, _ in rows])
+                self._vacuum = True
+
+        # Version 4: full-text index over the results stored so far
+        if version < 4:
+            rows = cur.execute("SELECT link, title, snippet FROM results GROUP BY link").fetchall()
+            for i in range(0, len(rows), 500):
+                chunk = rows[i:i + 500]
+                html = self.html.get_many(link for link, _, _ in chunk)
+                self.text.add_many(TextIndex.documents((link, title, snippet, html.get(link))
+                                                       for link, title, snippet in chunk),
+                                   commit=False)
+
+        # Version 5: results keyed by the normalized query, see query_keys.normalize_query
+        if version < 5:
+            query_ids = [row[0] for row in cur.execute("SELECT DISTINCT query FROM results WHERE query IS NOT NULL")]
+            for old_id in query_ids:
+                new_id = make_query_id(*split_query_id(old_id))
+                if new_id != old_id:
+                    # Where both spellings stored the same link, the first one moved wins
+                    cur.execute("UPDATE OR IGNORE results SET query=? WHERE query=?", [new_id, old_id])
+                    cur.execute("DELETE FROM results WHERE query=?", [old_id])
+                self.queries.add_many([new_id], commit=False)
+
+        # Version 6: cache validators for conditional re-scraping
+        existing = {row[1] for row in cur.execute("PRAGMA table_info(pages)")}
+        for column in ("etag", "last_modified"):
+            if column not in existing:
+                cur.execute(f"ALTER TABLE pages ADD COLUMN {column} TEXT")
+
+        # Version 7: put_many deletes replaced content; drop what earlier versions left behind
+        if version < 7:
+            cur.execute("DELETE FROM html_blobs WHERE NOT EXISTS "
+                        "(SELECT 1 FROM pages WHERE pages.hash = html_blobs.hash)")
+            self._vacuum = self._vacuum or cur.rowcount > 0
+
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def query_results(self, query, include_html=False):
+        """
+        Load the stored results for a query in rank order.
+
+        Args:
+            query (str): Query ID the results were stored under
+            include_html (bool): Also load the raw page HTML, which is by far the largest column
+
+        Returns:
+            DataFrame: Stored results
+        """
+        columns = [c for c in self.columns if c != "html"]
+        df = pd.read_sql(f"select {', '.join(columns)} from results where query=? order by rank asc;", self.con,
+                         params=[query])
+        if include_html:
+            html = self.html.get_many(df["link"])
+            df["html"] = [html.get(link, "") for link in df["link"]]
         return df
 
     def insert_row(self, values):
-        cur = self.con.cursor()
-        try:
-            cur.execute('INSERT INTO results(query, rank, link, title, snippet, html, created) VALUES(?,?,?,?,?,?,?)',
-                        values)
+        if isinstance(values, pd.Series):
+            # Series: insert whichever columns it carries
+            columns = list(values.index)
+            values = list(values)
+        else:
+            columns = ["query", "rank", "link", "title", "snippet", "html", "created"]
+            values = list(values)
+        row = dict(zip(columns, values))
+        self.text.add_many(TextIndex.documents([(row.get("link"), row.get("title"), row.get("snippet"),
+                                                 row.get("html"))]))
+        if "html" in columns:
+            # HTML lives in the HTML store rather than inline
+            position = columns.index("html")
+            self.html.put(values[columns.index("link")], values[position])
+            values[position] = None
+        placeholders = ",".join("?" * len(columns))
+        with self.pool.write_lock:
+            cur = self.con.cursor()
+            try:
+                cur.execute(f'INSERT INTO results({", ".join(columns)}) VALUES({placeholders})',
+                            values)
+                self.con.commit()
+            except sqlite3.IntegrityError:
+                pass
+            cur.close()
+
+    def insert_results(self, results, replace=False):
+        """
+        Insert or update many results in a single transaction.
+
+        Results that already exist for the same query and link are updated in
+        place, keeping any relevance feedback they have.
+
+        Args:
+            results (DataFrame): Results with the columns in RESULT_COLUMNS;
+                missing columns are stored as NULL. Optional etag and
+                last_modified columns are kept with the page HTML.
+            replace (bool): Also delete stored results of the same queries whose
+                link isn't in results, e.g. when refreshing a query
+        """
+        if results.empty:
+            return
+        # HTML lives in the HTML store rather than inline
+        columns = [column for column in RESULT_COLUMNS if column != "html"]
+        rows = to_rows(results.reindex(columns=columns), columns)
+        updates = ", ".join(f"{column}=excluded.{column}" for column in columns
+                            if column not in ("query", "link"))
+        # Parse the pages before taking the write lock, which every other writer waits on
+        docs = TextIndex.documents(results.reindex(columns=["link", "title", "snippet", "html"])
+                                   .itertuples(index=False, name=None))
+        con = self.con
+        with self.pool.write_lock, con:
+            if replace:
+                for query, links in results.groupby("query")["link"]:
+                    links = list(links)
+                    con.execute(f"DELETE FROM results WHERE query=? AND link NOT IN ({','.join('?' * len(links))})",
+                                [query, *links])
+            if "html" in results:
+                pages = results.reindex(columns=["link", "html", "etag", "last_modified"])
+                self.html.put_many(pages.itertuples(index=False, name=None), commit=False)
+            self.text.add_many(docs, commit=False)
+            self.queries.add_many(results["query"].dropna(), commit=False)
+            con.executemany(
+                f'INSERT INTO results({", ".join(columns)}) VALUES({",".join("?" * len(columns))}) '
+                f'ON CONFLICT(query, link) DO UPDATE SET {updates}',
+                rows)
+
+    def update_relevance(self, query, link, relevance):
+        with self.pool.write_lock:
+            cur = self.con.cursor()
+            cur.execute('UPDATE results SET relevance=? WHERE query=? AND link=?', [relevance, query, link])
+            self.con.commit()
+            cur.close()
+
+    def update_enhancements(self, results):
+        """Save recomputed ranks, scores and verdicts for stored results."""
+        rows = to_rows(results, ["rank", "semantic_score", "filter_verdict", "enhanced_model", "enhanced_at",
+                                 "query", "link"])
+        with self.pool.write_lock:
+            cur = self.con.cursor()
+            cur.executemany('UPDATE results SET rank=?, semantic_score=?, filter_verdict=?, enhanced_model=?, '
+                            'enhanced_at=? WHERE query=? AND link=?', rows)
             self.con.commit()
-        except sqlite3.IntegrityError:
-            pass
+            cur.close()
+
+
+class ResponseCache():
+    # Access times are written back in batches of this many, or with the next put()
+    ACCESS_FLUSH = 100
+
+    def __init__(self, path=DB_PATH, ttl=7 * 24 * 3600, max_entries=10000, pool=None):
+        """
+        Persistent LRU cache for LLM responses.
+
+        Entries are keyed by model name and prompt, expire after ttl seconds,
+        and the least recently used entries are evicted beyond max_entries.
+        Lookups only read; the access times they record are written back
+        in batches, so a hit never waits for the write lock.
+
+        Args:
+            path (str): SQLite database file
+            ttl (float): Seconds an entry stays valid
+            max_entries (int): Maximum number of entries kept
+            pool (ConnectionPool, optional): Pool to use instead of the process-wide pool for path
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.pool = pool or get_pool(path)
+        self._accessed = {}     # key -> access time not written back yet
+        self._accessed_lock = threading.Lock()
+        with self.pool.write_lock:
+            self.setup_tables()
+
+    @property
+    def con(self):
+        return self.pool.connection()
+
+    def setup_tables(self):
+        cur = self.con.cursor()
+        cur.execute(r"""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created REAL,
+                accessed REAL
+            );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed);")
+        self.con.commit()
         cur.close()
 
-    def update_relevance(self, query, link, relevance):
+    @staticmethod
+    def make_key(model, prompt):
+        # Prompts are built from indented f-strings, so whitespace differences don't matter
+        normalized = re.sub(r"\s+", " ", prompt).strip()
+        return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, model, prompt):
+        """
+        Look up a cached response.
+
+        Args:
+            model (str): Model name
+            prompt (str): Prompt sent to the model
+
+        Returns:
+            str: Cached response text, or None on a miss
+        """
+        key = self.make_key(model, prompt)
+        now = time.time()
         cur = self.con.cursor()
-        cur.execute('UPDATE results SET relevance=? WHERE query=? AND link=?', [relevance, query, link])
+        cur.execute("SELECT response, created FROM llm_cache WHERE key=?", [key])
+        row = cur.fetchone()
+        cur.close()
+        # Expired entries count as misses; the next put() for the prompt replaces them
+        if row is None or now - row[1] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self._accessed_lock:
+            self._accessed[key] = now
+            flush = len(self._accessed) >= self.ACCESS_FLUSH
+        if flush:
+            self.flush()
+        return row[0]
+
+    def _write_accessed(self, cur):
+        with self._accessed_lock:
+            accessed, self._accessed = self._accessed, {}
+        cur.executemany("UPDATE llm_cache SET accessed=? WHERE key=?",
+                        [[when, key] for key, when in accessed.items()])
+
+    def flush(self):
+        """Write the recorded access times back to the database."""
+        with self.pool.write_lock:
+            cur = self.con.cursor()
+            self._write_accessed(cur)
+            self.con.commit()
+            cur.close()
+
+    def put(self, model, prompt, response):
+        """
+        Store a response, evicting the least recently used entries if the cache is full.
+
+        Args:
+            model (str): Model name
+            prompt (str): Prompt sent to the model
+            response (str): Response text
+        """
+        key = self.make_key(model, prompt)
+        now = time.time()
+        with self.pool.write_lock:
+            cur = self.con.cursor()
+            # Eviction goes by access time, so bring it up to date first
+            self._write_accessed(cur)
+            cur.execute("INSERT OR REPLACE INTO llm_cache(key, model, response, created, accessed) VALUES(?,?,?,?,?)",
+                        [key, model, response, now, now])
+            cur.execute("DELETE FROM llm_cache WHERE key IN "
+                        "(SELECT key FROM llm_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                        [self.max_entries])
+            self.con.commit()
+            cur.close()
+
+    def stats(self):
+        """Return the hit and miss counts and the hit ratio since startup."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class VectorIndex():
+    def __init__(self, path=DB_PATH, pool=None):
+        """
+        Local index of document embeddings, keyed by link and embedding model.
+
+        Every vector is stored with a hash of the text it was computed from,
+        so a page whose title, snippet or content changed is embedded again.
+
+        Args:
+            path (str): SQLite database file
+            pool (ConnectionPool, optional): Pool to use instead of the process-wide pool for path
+        """
+        self.pool = pool or get_pool(path)
+        with self.pool.write_lock:
+            self.setup_tables()
+
+    @property
+    def con(self):
+        return self.pool.connection()
+
+    def setup_tables(self):
+        self.con.execute(r"""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                link TEXT NOT NULL,
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                created DATETIME,
+                PRIMARY KEY (link, model)
+            );
+        """)
         self.con.commit()
-        cur.close()
\ No newline at end of file
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model, texts):
+        """
+        Load the stored vectors that are still current.
+
+        Args:
+            model (str): Embedding model name
+            texts (dict): Text that was embedded for each link
+
+        Returns:
+            dict: float32 vector for each link whose stored text hash matches
+        """
+        wanted = {link: self.text_hash(text) for link, text in texts.items()}
+        links = list(wanted)
+        vectors = {}
+        cur = self.con.cursor()
+        for i in range(0, len(links), 500):
+            chunk = links[i:i + 500]
+            cur.execute("SELECT link, text_hash, vector FROM embeddings "
+                        f"WHERE model = ? AND link IN ({','.join('?' * len(chunk))})", [model, *chunk])
+            for link, text_hash, vector in cur.fetchall():
+                if wanted[link] == text_hash:
+                    vectors[link] = np.frombuffer(vector, dtype=np.float32)
+        cur.close()
+        return vectors
+
+    def put_many(self, model, texts, vectors):
+        """
+        Store vectors for many links.
+
+        Args:
+            model (str): Embedding model name
+            texts (dict): Text that was embedded for each link
+            vectors (dict): Vector for each link
+        """
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [[link, model, self.text_hash(texts[link]), np.asarray(vector, dtype=np.float32).tobytes(), now]
+                for link, vector in vectors.items()]
+        if not rows:
+            return
+        with self.pool.write_lock:
+            self.con.executemany(
+                "INSERT INTO embeddings(link, model, text_hash, vector, created) VALUES(?,?,?,?,?) "
+                "ON CONFLICT(link, model) DO UPDATE SET text_hash=excluded.text_hash, "
+                "vector=excluded.vector, created=excluded.created", rows)
+            self.con.commit()